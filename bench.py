@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import engine
+import exporter
+import propagation
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+# Benchmark of the search -> sort -> layout -> propagate -> export pipeline.
+# Every stage records wall time, peak traced memory (numpy buffers included) and the size of what it produced;
+# the results go to a JSON file that a later run can be compared against (--compare).
+#
+#   python bench.py --out bench.json
+#   python bench.py --diameters 50 200 --out new.json --compare bench.json
+
+# (case, DesignRequest fields, sort modes)
+BUNDLED = [
+    ("dep-uv", dict(domain="Ultra Violet", wavelength="248", pol="Dependent", pol_value="RCP",
+                    materials=["SiNx (High)", "SiNx (Mid)", "SiNx (Low)", "ZrO2 (PER)"]), ["Transmittance", "FoM"]),
+    ("co-vis", dict(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol",
+                    materials=["aSi (Vis)", "TiO2", "TiO2 (PER)"]), ["Transmittance", "FoM (fast)", "FoM (exact)", "Focusing"]),
+    ("cross-uv", dict(domain="Ultra Violet", wavelength="248", pol="Independent", pol_value="Cross-pol",
+                      materials=["SiNx (High)", "SiNx (Mid)", "SiNx (Low)", "ZrO2 (PER)"]), ["Transmittance", "FoM (fast)", "Focusing"]),
+]
+SYNTHETIC = [
+    ("dep-synth", dict(domain="Visible", wavelength="532", pol="Dependent", pol_value="RCP",
+                       materials=["userMadeBench"]), ["Transmittance", "FoM"]),
+    ("co-synth", dict(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol",
+                      materials=["userMadeBench"]), ["Transmittance", "FoM (fast)", "Focusing"]),
+]
+NA = 0.3
+
+
+def synthetic_libraries(matdir, rows, seed=0):
+    # Random libraries in the bundled layout, about `rows` rows per file, every (H, P) group covering 2 pi
+    rng = np.random.default_rng(seed)
+    H = np.arange(300, 701, 20) * engine.nm
+    P = np.arange(250, 451, 10) * engine.nm
+    per_group = max(1, rows // (len(H) * len(P)))
+    hh, pp = np.meshgrid(H, P, indexing='ij')
+    hp = np.repeat(np.column_stack([hh.ravel(), pp.ravel()]), per_group, axis=0)
+    n = hp.shape[0]
+    size = hp[:, 1] * rng.uniform(0.1, 0.8, n)
+    T = rng.uniform(0.5, 1, n)
+    phase = rng.uniform(-math.pi, math.pi, n)
+    for shape in ["circle", "square"]:
+        # H-P-R(X)-T-phase
+        np.save(os.path.join(matdir, f"Vis_userMadeBench_532_{shape}.npy"),
+                np.column_stack([hp, size, T, phase]).astype(np.float32))
+    # H-P-L-W-T-phase
+    width = hp[:, 1] * rng.uniform(0.1, 0.8, n)
+    np.save(os.path.join(matdir, "Vis_userMadeBench_532_rectangle.npy"),
+            np.column_stack([hp, size, width, T, phase]).astype(np.float32))
+
+
+def nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+def folder_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+
+    def run(self, record, stage, fn, *args, size=nbytes, items=None):
+        # Runs fn(*args) once and appends its record; returns the result (None if skipped or failed)
+        row = dict(record, stage=stage)
+        if self.args.memory:
+            tracemalloc.start()
+        t = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Exception as e:
+            row.update(wall_s=time.perf_counter() - t, error=f"{type(e).__name__}: {e}")
+            result = None
+        else:
+            row.update(wall_s=time.perf_counter() - t, output_bytes=size(result))
+            if items is not None:
+                row["items"] = items(result)
+        if self.args.memory:
+            row["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        self.results.append(row)
+        self.show(row)
+        return result
+
+    def skip(self, record, stage, reason):
+        row = dict(record, stage=stage, skipped=reason)
+        self.results.append(row)
+        self.show(row)
+
+    @staticmethod
+    def show(row):
+        name = f'{row["suite"]:9s} {row["case"]:9s} {row["D_um"]:>7g} um  {row["stage"]:24s}'
+        if "skipped" in row:
+            print(f'{name} skipped ({row["skipped"]})', flush=True)
+        elif "error" in row:
+            print(f'{name} {row["wall_s"]:9.3f} s  failed: {row["error"]}', flush=True)
+        else:
+            peak = f'{row["peak_mb"]:9.1f} MB' if "peak_mb" in row else ' ' * 12
+            print(f'{name} {row["wall_s"]:9.3f} s  {peak}  {row.get("output_bytes", 0)/2**20:9.2f} MB out', flush=True)
+
+    def case(self, suite, name, fields, sorts, matdir, D):
+        args = self.args
+        f = D / (2 * NA) * math.sqrt(1 - NA**2)
+        req = engine.DesignRequest(na=NA, f=f, D=D, matdir=matdir, workers=args.workers, **fields)
+        record = dict(suite=suite, case=name, D_um=D)
+        engine.library_cache.clear()
+        rst_dict = self.run(record, "search", engine.search, req, items=lambda r: sum(np.shape(v)[0] for v in r.values()))
+        if not rst_dict:
+            return
+
+        ranked = None
+        for sort_choice in sorts:
+            sort_req = engine.DesignRequest(**dict(req.__dict__, sort_choice=sort_choice, weight=None))
+            pixels = self.sort_pixels(req, rst_dict)
+            if sort_choice == "FoM (exact)" and pixels > args.max_exact_pixels:
+                self.skip(record, f"sort {sort_choice}", f"{pixels} pixels > --max-exact-pixels")
+                continue
+            if pixels > args.max_sort_pixels:
+                self.skip(record, f"sort {sort_choice}", f"{pixels} pixels > --max-sort-pixels")
+                continue
+            libraries = rst_dict
+            if sort_choice == "FoM (exact)":
+                # Per-pixel search in Python: timed on the first libraries only
+                libraries = dict(list(rst_dict.items())[:args.exact_libraries])
+            result = self.run(record, f"sort {sort_choice}", engine.rank, sort_req, libraries, items=len)
+            if ranked is None and result:
+                ranked = (sort_req, result)
+        if ranked is None:
+            ranked = (req, rst_dict)
+        sort_req, result = ranked
+
+        # The best candidate, and the best one the 2D propagation accepts
+        rst_ar, key, P = engine.pick_candidate(sort_req, result, 0)
+        record = dict(record, grid=math.floor(D * engine.um / P))
+        self.run(record, "propagate radial", engine.propagate_radial, req, rst_ar, P)
+        if record["grid"]**2 > args.max_pixels:
+            for stage in ["layout", "propagate 2D", "DetailWindow"] + [f"export {fmt}" for fmt in args.formats]:
+                self.skip(record, stage, f"{record['grid']}^2 pixels > --max-pixels")
+            return
+        layout = self.run(record, "layout", engine.make_layout, req, rst_ar, key, P,
+                          size=lambda lay: nbytes([lay.phase_ideal, lay.phase_meta, lay.idx]))
+        candidates = [engine.pick_candidate(sort_req, result, k) for k in range(min(len(result), 200))] if req.pol == "Independent" else [(rst_ar, key, P)]
+        propagatable = [c for c in candidates if req.wl < c[2] * math.sqrt(2)]
+        if propagatable:
+            propagation.transfer_cache.clear()
+            self.run(dict(record, grid=math.floor(D * engine.um / propagatable[0][2])), "propagate 2D", engine.propagate, req, *propagatable[0][::2])
+        else:
+            self.skip(record, "propagate 2D", "no candidate with wl < P sqrt(2)")
+        if req.pol == "Independent" and layout is not None and not args.no_gui:
+            if record["grid"] > args.max_table:
+                self.skip(record, "DetailWindow", "grid > --max-table")
+            else:
+                self.run(record, "DetailWindow", self.detail_window, req, rst_ar, layout, size=lambda w: 0)
+        if layout is None:
+            return
+        for fmt in args.formats:
+            if record["grid"]**2 > args.max_export_pixels:
+                self.skip(record, f"export {fmt}", f"{record['grid']}^2 pixels > --max-export-pixels")
+                continue
+            exportdir = tempfile.mkdtemp(prefix="metacraft-bench-")
+            export_req = engine.DesignRequest(**dict(req.__dict__, exportdir=os.path.join(exportdir, "")))
+            self.run(record, f"export {fmt}", exporter.export, export_req, layout, "bench", fmt,
+                     size=lambda _: folder_bytes(exportdir))
+            shutil.rmtree(exportdir, ignore_errors=True)
+
+    @staticmethod
+    def sort_pixels(req, rst_dict):
+        # Lens pixels at the smallest pitch an Independent sort lays out (Dependent sorts lay out nothing)
+        if req.pol == "Dependent":
+            return 0
+        return math.floor(req.D * engine.um / min(engine.key_pitch(key) for key in rst_dict))**2
+
+    @staticmethod
+    def detail_window(req, rst_ar, layout):
+        from PySide6.QtWidgets import QApplication
+        from newwindow import DetailWindow
+        app = QApplication.instance() or QApplication([])
+        w = DetailWindow(layout.idx + 1, rst_ar[:, 2:6], req.pol_value)
+        app.processEvents()
+        w.deleteLater()
+        return w
+
+
+def compare(results, base_path, tolerance):
+    # Wall time / peak memory ratios against an earlier run; returns the number of stages over tolerance
+    with open(base_path) as f:
+        base = {(r["suite"], r["case"], r["D_um"], r["stage"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print(f"\nCompared with {base_path} (tolerance x{tolerance:g}):")
+    for row in results:
+        old = base.get((row["suite"], row["case"], row["D_um"], row["stage"]))
+        if old is None or "wall_s" not in old or "wall_s" not in row or "error" in row or "error" in old:
+            continue
+        t = row["wall_s"] / max(old["wall_s"], 1e-6)
+        m = row["peak_mb"] / max(old["peak_mb"], 1e-6) if "peak_mb" in row and "peak_mb" in old else 1.0
+        # Sub-10 ms stages are too noisy to flag
+        flag = (t > tolerance and row["wall_s"] > 0.01) or (m > tolerance and row.get("peak_mb", 0) > 1)
+        regressions += flag
+        print(f'{"!" if flag else " "} {row["suite"]:9s} {row["case"]:9s} {row["D_um"]:>7g} um  {row["stage"]:24s} time x{t:6.2f}  memory x{m:6.2f}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bench", description="Time the MetaCraft pipeline on bundled and synthetic libraries.")
+    parser.add_argument("--diameters", nargs="+", type=float, default=[50, 200, 1000, 3000], help="Lens diameters (um)")
+    parser.add_argument("--suite", nargs="+", choices=["bundled", "synthetic"], default=["bundled", "synthetic"])
+    parser.add_argument("--cases", nargs="+", help="Only these cases (e.g. co-vis dep-synth)")
+    parser.add_argument("--synthetic-rows", type=int, default=1_000_000, help="Rows of each synthetic library file")
+    parser.add_argument("--formats", nargs="+", default=list(exporter.EXPORTERS), choices=list(exporter.EXPORTERS))
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-pixels", type=float, default=2e7, help="Skip 2D stages of lenses with more pixels")
+    parser.add_argument("--max-export-pixels", type=float, default=4e6, help="Skip exports of lenses with more pixels")
+    parser.add_argument("--max-sort-pixels", type=float, default=4e6, help="Skip Independent sorts of lenses with more pixels")
+    parser.add_argument("--max-exact-pixels", type=float, default=4e4, help="Skip FoM (exact) above this many pixels")
+    parser.add_argument("--exact-libraries", type=int, default=10, help="Libraries ranked by the FoM (exact) stage")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Do not trace memory (tracing slows the pure-Python stages down)")
+    parser.add_argument("--max-table", type=int, default=200, help="Skip DetailWindow above this grid size")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the DetailWindow stage")
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", help="Earlier --out file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Ratio flagged as a regression by --compare")
+    args = parser.parse_args(argv)
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    # Stored search / sort results would be timed instead of the computation
+    engine.result_cache.enabled = False
+
+    bench = Bench(args)
+    synth_dir = None
+    try:
+        for suite in args.suite:
+            if suite == "bundled":
+                matdir, cases = os.path.join(BASEDIR, "Materials", ""), BUNDLED
+            else:
+                synth_dir = tempfile.mkdtemp(prefix="metacraft-bench-mat-")
+                synthetic_libraries(synth_dir, args.synthetic_rows)
+                matdir, cases = os.path.join(synth_dir, ""), SYNTHETIC
+            for name, fields, sorts in cases:
+                if args.cases and name not in args.cases:
+                    continue
+                for D in args.diameters:
+                    bench.case(suite, name, fields, sorts, matdir, D)
+    finally:
+        if synth_dir is not None:
+            shutil.rmtree(synth_dir, ignore_errors=True)
+
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(), "args": vars(args)}
+    with open(args.out, "w") as f:
+        json.dump({"meta": meta, "results": bench.results}, f, indent=1)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        return 1 if compare(bench.results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+class LibraryCache:
+    # LRU cache of loaded (and preprocessed) meta-atom libraries, bounded by the bytes of the cached arrays.
+    # Keys carry the source file mtimes, so an edited library is reloaded on its next use.
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sizeof(value):
+        arrays = value if isinstance(value, tuple) else (value,)
+        return sum(ar.nbytes for ar in arrays if isinstance(ar, np.ndarray))
+
+    def get(self, key, build):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+        self.misses += 1
+        value = build()
+        if value is None:
+            return None
+        for ar in value if isinstance(value, tuple) else (value,):
+            ar.setflags(write=False)
+        size = self.sizeof(value)
+        with self.lock:
+            if size <= self.max_bytes and key not in self.entries:
+                self.entries[key] = (value, size)
+                self.nbytes += size
+                self.evict(self.max_bytes)
+        return value
+
+    def evict(self, max_bytes):
+        while self.nbytes > max_bytes and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict(max_bytes)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+import engine
+import exporter
+import instrument
+import sweep
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="metacraft", description="MetaCraft without the GUI: search, sort and export metalens designs.")
+    parser.add_argument("command", choices=["search", "sort", "export", "scan", "sweep"])
+    parser.add_argument("--request", help="JSON file with DesignRequest fields (flags below override it)")
+    parser.add_argument("--domain", choices=list(engine.DOMAIN_TAGS))
+    parser.add_argument("--wl", dest="wavelength", help="Wavelength (nm)")
+    parser.add_argument("--pol", choices=["Dependent", "Independent"])
+    parser.add_argument("--pol-value", dest="pol_value", choices=["RCP", "LCP", "Co-pol", "Cross-pol"])
+    parser.add_argument("--na", type=float)
+    parser.add_argument("--f", type=float, help="Focal length (um)")
+    parser.add_argument("--D", type=float, help="Diameter (um)")
+    parser.add_argument("--min-T", dest="min_T", type=float, help="Minimum transmittance (%%)")
+    parser.add_argument("--max-H", dest="max_H", type=int, help="Maximum height (nm)")
+    parser.add_argument("--max-AR", dest="max_AR", type=float, help="Maximum aspect ratio")
+    parser.add_argument("--materials", nargs="+")
+    parser.add_argument("--sort", dest="sort_choice", choices=["Transmittance", "FoM", "FoM (fast)", "FoM (exact)", "Focusing"])
+    parser.add_argument("--weight", nargs=4, type=float)
+    parser.add_argument("--level", dest="rotation_level", type=int, help="Rotation level (Dependent)")
+    parser.add_argument("--workers", type=int, help="Processes used to rank Independent libraries (0 = all cores)")
+    parser.add_argument("--assignment", choices=["Phase", "Complex"], help="Independent atom choice: nearest phase or nearest complex transmission")
+    parser.add_argument("--amplitude-weight", dest="amplitude_weight", type=float, help="Complex assignment: extra weight of the amplitude error")
+    parser.add_argument("--reverse-gds", dest="reverse_gds", action="store_true", default=None)
+    parser.add_argument("--matdir")
+    parser.add_argument("--exportdir")
+    parser.add_argument("--cache-mb", dest="cache_mb", type=int, help="Memory budget of the library cache (MB)")
+    parser.add_argument("--result-cache-mb", dest="result_cache_mb", type=int, help="Disk budget of the search / sort result cache (MB)")
+    parser.add_argument("--no-result-cache", dest="result_cache", action="store_false", help="Always recompute searches and sorts")
+    parser.add_argument("--top", type=int, default=0, help="Only print the first N results")
+    parser.add_argument("--pick", type=int, default=0, help="Result to export (0 = best)")
+    parser.add_argument("--z", nargs=3, type=float, metavar=("START", "STOP", "NUM"), help="Focal scan planes (um); default f +- 4 wl / NA^2, 64 planes")
+    parser.add_argument("--format", nargs="+", default=["gds"], choices=list(exporter.EXPORTERS))
+    parser.add_argument("--name", default="metalens", help="Export file name")
+    parser.add_argument("--grid", nargs="+", action="append", default=[], metavar=("FIELD", "VALUE"),
+                        help=f"Sweep FIELD ({', '.join(sweep.GRID_FIELDS)}) over values or START:STOP:NUM ranges; repeat for more fields")
+    parser.add_argument("--keep", type=int, default=10, help="Sweep: best candidates kept per point")
+    parser.add_argument("--table", help="Sweep table (.csv or .parquet); default <exportdir>/<name>_sweep.csv")
+    parser.add_argument("--export-top", dest="export_top", type=int, default=0, help="Sweep: export the K best designs in --format")
+    parser.add_argument("--perf", action="store_true", help="Print the time, peak memory and counts of every stage to stderr")
+    parser.add_argument("--perf-log", dest="perf_log", help="Append the stage records to this JSON-lines file")
+    return parser
+
+
+def make_request(args):
+    fields = {"matdir": os.path.join(BASEDIR, "Materials", ""), "exportdir": os.path.join(BASEDIR, "Export", "")}
+    if args.request:
+        with open(args.request) as f:
+            fields.update(json.load(f))
+    for name in engine.DesignRequest.__dataclass_fields__:
+        value = getattr(args, name, None)
+        if value is not None:
+            fields[name] = value
+    if fields.get("workers") == 0:
+        fields["workers"] = os.cpu_count()
+    return engine.DesignRequest(**fields)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    req = make_request(args)
+    if args.cache_mb is not None:
+        engine.library_cache.resize(args.cache_mb * 2**20)
+    engine.result_cache.enabled = args.result_cache
+    if args.result_cache_mb is not None:
+        engine.result_cache.resize(args.result_cache_mb * 2**20)
+    if args.perf_log:
+        instrument.recorder.set_log(args.perf_log)
+    mark = instrument.recorder.mark()
+    try:
+        return run(args, req)
+    finally:
+        if args.perf:
+            for line in instrument.summary_lines(instrument.recorder.since(mark)):
+                print(line, file=sys.stderr)
+
+
+def run(args, req):
+    if args.command == "sweep":
+        return run_sweep(args, req)
+    rst_dict = engine.search(req)
+    if args.command == "search":
+        lines = engine.search_lines(req, rst_dict)
+    else:
+        rst_dict = engine.rank(req, rst_dict)
+        lines = engine.rank_lines(req, rst_dict)
+    if len(lines) == 0:
+        print("No result found", file=sys.stderr)
+        return 1
+
+    if args.command == "export":
+        rst_ar, key, P = engine.pick_candidate(req, rst_dict, args.pick)
+        layout = engine.make_layout(req, rst_ar, key, P)
+        for fmt in args.format:
+            print(exporter.export(req, layout, args.name, fmt))
+    elif args.command == "scan":
+        rst_ar, key, P = engine.pick_candidate(req, rst_dict, args.pick)
+        z = engine.scan_planes(req) if args.z is None else np.linspace(args.z[0], args.z[1], int(args.z[2])) * engine.um
+        path = req.exportdir + args.name + "_zstack.npy"
+        _, x, axial, _ = engine.focal_scan(req, rst_ar, P, z, path)
+        z_focus, dof = engine.focal_metrics(z, axial)
+        print(f"# {key}: focus at z = {z_focus/engine.um:g} um, DOF {dof/engine.um:g} um, planes in {path}")
+        for zk, Ik in zip(z, axial):
+            print(f"{zk/engine.um:.4f}\t{Ik:.6f}")
+    else:
+        for line in lines[:args.top] if args.top > 0 else lines:
+            print(line.strip("\n"))
+    return 0
+
+
+def run_sweep(args, req):
+    grids = {}
+    for field, *values in args.grid:
+        if field not in sweep.GRID_FIELDS or not values:
+            raise SystemExit(f"--grid: expected one of {', '.join(sweep.GRID_FIELDS)} followed by values, got {field} {' '.join(values)}")
+        grids[field] = [v for text in values for v in sweep.parse_values(text, sweep.GRID_FIELDS[field])]
+    requests = sweep.grid_requests(req, grids)
+    rows = sweep.run_sweep(requests, req.workers, args.keep)
+    path = sweep.write_table(rows, args.table or req.exportdir + args.name + "_sweep.csv")
+    print(f"# {len(requests)} points, {len(rows)} candidates in {path}")
+    for row in rows[:args.top]:
+        print("\t".join(str(row.get(column, "")) for column in sweep.COLUMNS))
+    for out in sweep.export_top(requests, rows, args.export_top, args.name, args.format):
+        print(out)
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1022 @@
+import os
+import re
+import math
+import hashlib
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from collections import OrderedDict
+import store
+import cache
+import resultcache
+import propagation
+import instrument
+
+nm = 1e-9
+um = 1e-6
+NUM_GAP = 90
+DOMAIN_TAGS = {"Ultra Violet": "UV", "Visible": "Vis", "Near Infrared": "NIR"}
+LIBRARY_SHAPES = {"Dependent": ['rectangle'], "Co-pol": ['circle', 'square'], "Cross-pol": ['rectangle']}
+
+library_cache = cache.LibraryCache()
+result_cache = resultcache.ResultCache()
+rank_pool = None        # (workers, ProcessPoolExecutor) kept between sorts
+rank_pool_lock = threading.Lock()
+candidate_sets = OrderedDict()     # last CandidateSet of each library, see material_candidates
+candidate_lock = threading.Lock()
+MAX_CANDIDATE_SETS = 16
+complex_trees = OrderedDict()      # k-d trees of library transmissions, see complex_index
+complex_lock = threading.Lock()
+MAX_COMPLEX_TREES = 64
+
+
+class Cancelled(Exception):
+    # Raised by a progress callback to stop a running search / sort / propagation / export
+    pass
+
+
+@dataclass
+class DesignRequest:
+    # Same units as the GUI entries: wavelength / height in nm, f / D in um, T in %
+    domain: str = "Visible"
+    wavelength: str = "532"
+    pol: str = "Dependent"              # "Dependent" / "Independent"
+    pol_value: str = "RCP"              # "RCP" / "LCP" / "Co-pol" / "Cross-pol"
+    na: float = 0.1
+    f: float = 250
+    D: float = 50
+    min_T: float = 50
+    max_H: int = 700
+    max_AR: float = 35
+    materials: list = field(default_factory=list)
+    sort_choice: str = "Transmittance"
+    weight: list = None
+    rotation_level: int = 8
+    reverse_gds: bool = False
+    workers: int = 1                    # processes used to rank Independent libraries
+    single_precision: bool = False      # complex64 propagation
+    assignment: str = "Phase"           # Independent atom choice: "Phase" / "Complex" (nearest sqrt(T) e^(i phase))
+    amplitude_weight: float = 0.0       # Complex: extra weight of the amplitude error
+    matdir: str = "Materials/"
+    exportdir: str = "Export/"
+
+    def __post_init__(self):
+        self.wavelength = str(self.wavelength)
+        if self.weight is None:
+            self.weight = default_weights(self.pol, self.sort_choice)
+
+    @property
+    def wl(self):
+        return float(self.wavelength) * nm
+
+    @property
+    def domain_tag(self):
+        return DOMAIN_TAGS.get(self.domain, self.domain)
+
+    @property
+    def phase_idx(self):
+        return 4 if self.pol_value == 'Co-pol' else 5
+
+
+@dataclass
+class Layout:
+    rst_ar: np.ndarray
+    key: str
+    P: float
+    num: int
+    xlin: np.ndarray            # pixel centres (m)
+    phase_ideal: np.ndarray     # [num, num], nan outside the aperture
+    phase_meta: np.ndarray      # [num, num], nan outside the aperture
+    idx: np.ndarray = None      # Independent only: [num, num] library row, -1 outside the aperture
+
+
+def default_weights(pol, sort_choice):
+    if pol == "Dependent":
+        return [1, 0, 0, 0] if sort_choice == "Transmittance" else [0.5, 0.25, 0.25, 0]
+    return [0.5, 0, 0, 0.5] if sort_choice == "Transmittance" else [1/3, 1/6, 1/6, 1/3]
+
+
+# Result keys: "mat-H-P-meanAR-meanT-Strehl-FWHM-Eff-numel" (Focusing sort), "mat-H-P-meanAR-meanT-FOM-numel" (sort),
+# "mat-H-P-numel" (search) and "mat-numel" (Dependent). Material names may hold dashes and metrics may be negative,
+# so the numeric fields are matched from the right.
+NUM = r'(-?(?:[\d.]+|nan|inf))'
+KEY_PATTERNS = [re.compile(rf'^(.*)-(\d+)-(\d+)-{NUM}-{NUM}-{NUM}-{NUM}-{NUM}-(\d+)$'),
+                re.compile(rf'^(.*)-(\d+)-(\d+)-{NUM}-{NUM}-{NUM}-(\d+)$'),
+                re.compile(r'^(.*)-(\d+)-(\d+)-(\d+)$'),
+                re.compile(r'^(.*)-(\d+)$')]
+
+
+def split_key(key):
+    # (material, numeric fields as strings) of a result key
+    for pattern in KEY_PATTERNS:
+        match = pattern.match(key)
+        if match:
+            return match.group(1), list(match.groups()[1:])
+    raise ValueError(f"Unrecognised result key: {key}")
+
+
+def key_pitch(key):
+    return int(split_key(key)[1][1]) * nm
+
+
+def library_path(req, mat, shape):
+    return f'{req.matdir}{req.domain_tag}_{mat.replace(" ","")}_{req.wavelength}_{shape}.npy'
+
+
+def load_limits(req):
+    # Largest H and P (m) a search of req keeps
+    return req.max_H * nm, req.wl / (2 * req.na)
+
+
+def load_library(req, mat, shape, hp_limit=None):
+    # Only the rows within the height / pitch limits (by default the request's) are read from a packed store
+    # (see store.py)
+    path = library_path(req, mat, shape)
+    lib_store = store.open_store(req.matdir)
+    if lib_store is not None:
+        rst = lib_store.rows(os.path.basename(path), *(hp_limit or load_limits(req)))
+        if rst is not None:
+            return rst
+    try:
+        return np.load(path)
+    except FileNotFoundError:
+        return None
+
+
+def file_stamp(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def cached_library(req, kind, mat, hp_limit=None):
+    # kind: "Dependent" / "Co-pol" / "Cross-pol"; the preprocessed arrays come from library_cache.
+    # hp_limit: looser (H, P) limits to load with, so that requests differing only in height / NA share one load
+    paths = tuple(library_path(req, mat, shape) for shape in LIBRARY_SHAPES[kind])
+    hp_limit = (hp_limit or load_limits(req)) if store.open_store(req.matdir) is not None else None
+    key = (kind, paths, tuple(file_stamp(p) for p in paths), hp_limit)
+    return library_cache.get(key, lambda: build_library(req, kind, mat, hp_limit))
+
+
+@instrument.timed("load library", rows=lambda rst: 0 if rst is None else sum(ar.shape[0] for ar in (rst if isinstance(rst, tuple) else (rst,))))
+def build_library(req, kind, mat, hp_limit=None):
+    if kind == "Dependent":
+        # Rect: H-P-L-W-T-phase
+        return load_library(req, mat, 'rectangle', hp_limit)
+
+    elif kind == 'Co-pol':
+        rst_total = np.zeros((0, 6))
+        for shape in ['circle', 'square']:
+            # rst: H-P-R(X)-T-phase-shape(1 for circle 2for square)
+            rst = load_library(req, mat, shape, hp_limit)
+            if rst is None:
+                continue
+            rst_shape = np.ones_like(rst[:, 2]) if shape == 'circle' else 2 * np.ones_like(rst[:, 2])
+            rst = np.concatenate((rst, rst_shape.reshape(-1, 1)), axis=1)
+            rst_total = np.concatenate((rst_total, rst), axis=0)
+        return rst_total
+
+    elif kind == 'Cross-pol':
+        # Rect: H-P-L-W-Tr-Tl-phase, plus the same atoms rotated by 90 degrees
+        rst_ar = load_library(req, mat, 'rectangle', hp_limit)
+        if rst_ar is None:
+            return None
+        rst_ar_90 = np.copy(rst_ar)
+        rst_ar_90[:, 2] = np.copy(rst_ar[:, 3]); rst_ar_90[:, 3] = np.copy(rst_ar[:, 2])
+        rst_ar_90[:, 5] += math.pi
+        rst_ar_90[:, 5][rst_ar_90[:, 5] > math.pi] -= 2 * math.pi
+        return rst_ar, rst_ar_90
+
+
+def builtin_catalog():
+    # Wavelengths / materials of the bundled libraries
+    wl = {"Vis": [str(i) for i in range(400, 701, 5)] + ["532", "632.8"],
+          "NIR": ["900", "940", "980", "1550"],
+          "UV":  ["248", "266", "325", "384"]}
+    mat = {"UV":  ["Select All", "SiNx (High)", "SiNx (Mid)", "SiNx (Low)", "ZrO2 (PER)"],
+           "Vis": ["Select All", "aSi (Vis)", "TiO2", "TiO2 (PER)", "Si (PER)"],
+           "NIR": ["Select All", "aSi (NIR)", "Si (PER)"]}
+    for tag in wl:
+        wl[tag] = sorted(wl[tag], key=lambda x: float(x))
+    return wl, mat
+
+
+def scan_catalog(matdir):
+    # Built-in wavelengths / materials plus anything found as "userMade" in the material folder
+    wl, mat = builtin_catalog()
+    # ex): NIR_userMade-aSi (NIR)_940_rectangle.npy
+    for uf in os.listdir(matdir):
+        if "userMade" not in uf:
+            continue
+        tag = uf.split('_')[0]
+        if tag in wl:
+            wl[tag] = list(dict.fromkeys(wl[tag] + [uf.split('_')[2]]))
+            mat[tag].append(uf.split('_')[1])
+    for tag in wl:
+        wl[tag] = sorted(wl[tag], key=lambda x: float(x))
+    return wl, mat
+
+
+# ---------------------------------------------------------------- Search
+@instrument.timed("filter", rows=len, kept=np.count_nonzero)
+def filter_mask(req, rst, ar_cols):
+    # H, P, aspect ratio and T limits; T sits right after the size column(s)
+    wl = req.wl
+    cond1 = rst[:, 0] <= req.max_H * nm
+    cond2 = rst[:, 1] <= wl / (2 * req.na)
+    cond3 = np.all(rst[:, [0]] / rst[:, ar_cols] <= req.max_AR, axis=1)
+    cond4 = rst[:, ar_cols[-1] + 1] >= req.min_T / 100
+    return cond1 & cond2 & cond3 & cond4
+
+
+def filter_rows(req, rst, ar_cols):
+    return np.array(rst[filter_mask(req, rst, ar_cols)])
+
+
+@instrument.timed("coverage", groups=lambda r: r[0].shape[0], covered=lambda r: int(np.count_nonzero(r[1])))
+def group_coverage(hp, phase):
+    # 2pi phase coverage of every (H, P) group at once: sort by group then phase, and reduce per group
+    # the largest (circular) gap between neighbouring phases and the number of pi/4 sectors hit.
+    # Returns the unique (H, P), the coverage flags and each group's row indices in their original order.
+    hp_unique, inv = np.unique(hp, axis=0, return_inverse=True)
+    inv = inv.reshape(-1)
+    if hp_unique.shape[0] == 0:
+        return hp_unique, np.zeros(0, dtype=bool), []
+    order = np.lexsort((phase, inv))
+    g = inv[order]; p = phase[order]
+    starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+    ends = np.r_[starts[1:], g.shape[0]]
+    nxt = np.arange(1, g.shape[0] + 1); nxt[ends - 1] = starts    # last phase of a group wraps to its first
+    phase_diff = np.abs(p - p[nxt])
+    phase_diff[phase_diff > np.pi] -= 2 * np.pi
+    max_phase_diff = np.maximum.reduceat(np.abs(phase_diff), starts)
+    section = p // (np.pi/4)
+    new_section = np.r_[True, (section[1:] != section[:-1]) | (g[1:] != g[:-1])]
+    num_section = np.add.reduceat(new_section, starts)
+    covered = (max_phase_diff < np.pi/4) & (num_section == 8)
+    members = np.split(np.argsort(inv, kind='stable'), ends[:-1])
+    return hp_unique, covered, members
+
+
+def report(progress, done, total):
+    if progress is not None:
+        progress(done, total)
+
+
+def search_digest(req):
+    # Search parameters and the size / mtime of every library file the search reads
+    kind = "Dependent" if req.pol == "Dependent" else req.pol_value
+    libraries = [[[os.path.basename(p), file_fingerprint(p)] for p in (library_path(req, mat, shape) for shape in LIBRARY_SHAPES[kind])]
+                 for mat in req.materials]
+    return resultcache.digest("search", [req.domain, req.wavelength, req.pol, req.pol_value, req.na, req.min_T, req.max_H,
+                                         req.max_AR, list(req.materials), libraries])
+
+
+def rank_digest(req, rst_dict):
+    # Sort parameters and the content of the libraries being ranked
+    return resultcache.digest("rank", [req.wavelength, req.pol, req.pol_value, req.f, req.D, req.max_H, req.max_AR, req.sort_choice,
+                                       list(req.weight), req.rotation_level, req.single_precision, req.assignment,
+                                       req.amplitude_weight], rst_dict)
+
+
+@instrument.timed("search", results=len)
+def search(req, progress=None, hp_limit=None):
+    # Repeated searches (same parameters, unchanged library files) are read back from result_cache.
+    # hp_limit: see cached_library; any limits at least as loose as the request's keep the same rows
+    return result_cache.get(search_digest(req), lambda: search_libraries(req, progress, hp_limit))
+
+
+def search_libraries(req, progress=None, hp_limit=None):
+    selected_rst_dict = {}
+    kind = "Dependent" if req.pol == "Dependent" else req.pol_value
+    num_mat = len(req.materials)
+    for k, mat in enumerate(req.materials):
+        report(progress, k, num_mat)
+        candidates = material_candidates(req, kind, mat, hp_limit)
+        if candidates is None:
+            continue
+        if kind == "Dependent":
+            # Rect: H-P-L-W-T-phase
+            rst = candidates.group(0)
+            key = f'{mat}-{rst.shape[0]}'
+            selected_rst_dict[key] = rst
+            continue
+        for g, hp in enumerate(candidates.hp):     # 2pi phase coverage
+            rst_temp = candidates.group(g)
+            # key: "mat-H-P-numel"
+            # value: H-P-R(X)-T-phase-shape(1 or 2) (Co-pol) / H-P-L-W-Tr-Tl-phase (Cross-pol)
+            key = f'{mat}-{int(round(hp[0]/nm, -1))}-{int(round(hp[1]/nm, -1))}-{rst_temp.shape[0]}'
+            selected_rst_dict[key] = rst_temp
+    return selected_rst_dict
+
+
+@dataclass
+class CandidateSet:
+    # Rows of one material that passed a search: all of them (Dependent), or the (H, P) groups covering 2pi, group g
+    # being hp[g] and the rows part[bounds[g]:bounds[g+1]] of every part. Cross-pol keeps the atoms and their
+    # 90-degree copies as two parts, filtered together on the first.
+    limits: tuple               # search_limits of the request that produced it
+    parts: list
+    bounds: np.ndarray
+    hp: np.ndarray = None
+
+    def group(self, g):
+        return np.concatenate([part[self.bounds[g]:self.bounds[g+1]] for part in self.parts], axis=0)
+
+
+def search_limits(req):
+    # (max H, max P, max AR, min T) in the units of the library columns
+    return req.max_H * nm, req.wl / (2 * req.na), req.max_AR, req.min_T / 100
+
+
+def tightens(limits, previous):
+    return limits[0] <= previous[0] and limits[1] <= previous[1] and limits[2] <= previous[2] and limits[3] >= previous[3]
+
+
+def material_candidates(req, kind, mat, hp_limit=None):
+    # The last search of each library is kept: a search whose limits are all as tight or tighter only filters
+    # what it found, and loosening a limit goes back to the library
+    paths = tuple(library_path(req, mat, shape) for shape in LIBRARY_SHAPES[kind])
+    key = (kind, paths, tuple(file_stamp(p) for p in paths))
+    limits = search_limits(req)
+    with candidate_lock:
+        previous = candidate_sets.get(key)
+    if previous is not None and tightens(limits, previous.limits):
+        candidates = refilter(req, kind, previous, limits)
+    else:
+        candidates = filter_library(req, kind, mat, limits, hp_limit)
+    if candidates is not None:
+        with candidate_lock:
+            candidate_sets[key] = candidates
+            candidate_sets.move_to_end(key)
+            while len(candidate_sets) > MAX_CANDIDATE_SETS:
+                candidate_sets.popitem(last=False)
+    return candidates
+
+
+def grouped(limits, hp, groups, empty):
+    # CandidateSet of the covered groups, each given as its list of parts
+    parts = [np.concatenate([grp[i] for grp in groups], axis=0) if groups else part for i, part in enumerate(empty)]
+    bounds = np.concatenate(([0], np.cumsum([grp[0].shape[0] for grp in groups], dtype=np.int64))).astype(np.int64)
+    return CandidateSet(limits, parts, bounds, hp)
+
+
+def filter_library(req, kind, mat, limits, hp_limit=None):
+    lib = cached_library(req, kind, mat, hp_limit)
+    if lib is None:
+        return None
+    if kind == "Dependent":
+        rst = filter_rows(req, lib, [2, 3])
+        return CandidateSet(limits, [rst], np.array([0, rst.shape[0]], dtype=np.int64))
+    if kind == "Co-pol":
+        # rst: H-P-R(X)-T-phase-shape(1 for circle 2for square)
+        rst = filter_rows(req, lib, [2])
+        hp_unique, covered, members = group_coverage(rst[:, [0, 1]], rst[:, 4])
+        groups = [[rst[members[g]]] for g in np.flatnonzero(covered)]
+        return grouped(limits, hp_unique[covered], groups, [rst[:0]])
+    # Rect: H-P-L-W-Tr-Tl-phase, and the same atoms rotated by 90 degrees
+    rst_ar, rst_ar_90 = lib
+    mask = filter_mask(req, rst_ar, [2, 3])
+    half = int(np.count_nonzero(mask))
+    rst_total = np.concatenate((rst_ar[mask], rst_ar_90[mask]), axis=0)
+    hp_unique, covered, members = group_coverage(rst_total[:, [0, 1]], rst_total[:, 5])
+    groups = [[rst_total[m[m < half]], rst_total[m[m >= half]]] for m in (members[g] for g in np.flatnonzero(covered))]
+    return grouped(limits, hp_unique[covered], groups, [rst_total[:0], rst_total[:0]])
+
+
+def refilter(req, kind, previous, limits):
+    # Tighter limits keep a subset of every group. Coverage can only be lost, so a group that kept all of its rows
+    # stays covered, one that kept none is dropped, and only the groups that lost some rows are checked again.
+    ar_cols = [2] if kind == "Co-pol" else [2, 3]
+    mask = filter_mask(req, previous.parts[0], ar_cols)
+    if previous.hp is None:
+        rst = np.array(previous.parts[0][mask])
+        return CandidateSet(limits, [rst], np.array([0, rst.shape[0]], dtype=np.int64))
+    sizes = np.diff(previous.bounds)
+    if sizes.shape[0] == 0:
+        return CandidateSet(limits, previous.parts, previous.bounds, previous.hp)
+    kept = np.add.reduceat(mask.astype(np.int64), previous.bounds[:-1])
+    covered = kept == sizes
+    partial = np.flatnonzero((kept > 0) & (kept < sizes))
+    if partial.shape[0]:
+        rows = np.concatenate([np.concatenate([part[b0:b1][mask[b0:b1]] for part in previous.parts], axis=0)
+                               for b0, b1 in zip(previous.bounds[partial], previous.bounds[partial + 1])], axis=0)
+        _, still_covered, _ = group_coverage(rows[:, [0, 1]], rows[:, req.phase_idx])
+        covered[partial] = still_covered
+    mask &= np.repeat(covered, sizes)
+    bounds = np.concatenate(([0], np.cumsum(kept[covered]))).astype(np.int64)
+    return CandidateSet(limits, [part[mask] for part in previous.parts], bounds, previous.hp[covered])
+
+
+def search_lines(req, rst_dict):
+    def rorl(x):
+        return 'R' if x == 1 else 'L'
+    def circleorsquare(x):
+        return 'circle' if x == 1 else 'square'
+
+    lines = []
+    for key, rst in rst_dict.items():
+        mat, fields = split_key(key)
+        if req.pol == "Dependent":
+            lines += [f'{mat},  H: {int(round(arr[0]/nm, -1))} nm,  P: {int(round(arr[1]/nm, -1))} nm,  X: {int(round(arr[2]/nm, -1))} nm,  Y: {int(round(arr[3]/nm, -1))} nm,  T: {100*arr[4]: .1f} %,  φ: {arr[5]: .2f} rad' for arr in rst]
+            continue
+        if req.pol_value == 'Co-pol':
+            lines += [f'{mat}-{circleorsquare(arr[-1])},  H: {int(round(arr[0]/nm, -1))} nm,  P: {int(round(arr[1]/nm, -1))} nm,  {rorl(arr[-1])}: {int(round(arr[2]/nm, -1))} nm,  T: {100*arr[3]: .1f} %,  φ: {arr[4]: .2f} rad' for arr in rst]
+        else:
+            lines += [f'{mat},  H: {fields[0]} nm,  P: {fields[1]} nm,  X: {int(round(arr[2]/nm, -1))} nm,  Y: {int(round(arr[3]/nm, -1))} nm,  T: {100*arr[4]: .1f} %,  φ: {arr[5]: .2f} rad' for arr in rst]
+        lines.append('\n' + '-' * NUM_GAP + '\n')
+    if req.pol == "Independent" and len(lines) != 0:
+        lines.pop()
+    return lines
+
+
+# ---------------------------------------------------------------- Sort
+@instrument.timed("rank", candidates=len)
+def rank(req, rst_dict, progress=None):
+    # Repeated sorts of the same libraries with the same parameters are read back from result_cache
+    return result_cache.get(rank_digest(req, rst_dict), lambda: rank_libraries(req, rst_dict, progress), base=rst_dict)
+
+
+def rank_libraries(req, rst_dict, progress=None):
+    sorted_rst_dict = {}
+    num_key = len(rst_dict)
+    if req.pol == "Dependent":
+        for k, (mat_numel, rst_ar) in enumerate(rst_dict.items()):
+            report(progress, k, num_key)
+            if req.sort_choice == "Transmittance":
+                rst_ar = rst_ar[np.argsort(-rst_ar[:, 4])]
+            elif req.sort_choice == "FoM":
+                w1, w2, w3 = req.weight[:3]
+                FOM = w1 * rst_ar[:, 4] + w2 * (1 - rst_ar[:, 0] / req.max_H) + w3 * (1 - rst_ar[:, 0]/ np.min([rst_ar[:, 2], rst_ar[:, 3]]) / req.max_AR)
+                rst_ar = np.concatenate((rst_ar, FOM.reshape(-1, 1)), axis=1)
+                rst_ar = rst_ar[np.argsort(-rst_ar[:, -1])]
+            sorted_rst_dict[mat_numel] = rst_ar
+        return sorted_rst_dict
+
+    if req.sort_choice == "Focusing":
+        return rank_focusing(req, rst_dict, progress)
+    if req.workers > 1 and num_key > 1:
+        attributes = rank_parallel(req, rst_dict, progress)
+    else:
+        attributes = []
+        for k, (key, rst_ar) in enumerate(rst_dict.items()):
+            report(progress, k, num_key)
+            attributes.append(evaluate_candidate(req, key, rst_ar, None if progress is None else lambda frac: progress(k + frac, num_key)))
+    for key, (meanAR, meanT, FOM) in zip(rst_dict, attributes):
+        # Replace key to "mat-H-P-meanAR-meanT-FOM-numel"
+        numel = key.split("-")[-1]
+        new_key = f'{key[:-(len(numel)+1)]}-{float(meanAR) :.1f}-{float(meanT) :.1f}-{float(FOM) :.4f}-{numel}'
+        sorted_rst_dict[new_key] = rst_dict[key]
+    return OrderedDict(sorted(sorted_rst_dict.items(), key=lambda x: float(split_key(x[0])[1][-2]), reverse=True))
+
+
+def get_rank_pool(workers):
+    # Worker processes are started once and reused by later sorts; spawn keeps them clear of the GUI threads
+    global rank_pool
+    if rank_pool is None or rank_pool[0] != workers:
+        if rank_pool is not None:
+            rank_pool[1].shutdown(wait=False, cancel_futures=True)
+        rank_pool = (workers, ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")))
+    return rank_pool[1]
+
+
+def evaluate_chunk(req, items):
+    return [evaluate_candidate(req, key, rst_ar) for key, rst_ar in items]
+
+
+def rank_parallel(req, rst_dict, progress=None):
+    # Same attributes as the sequential loop, in rst_dict order; libraries are sent to the pool in chunks
+    # so that small ones do not pay one round trip each
+    global rank_pool
+    items = list(rst_dict.items())
+    chunk = max(1, math.ceil(len(items) / (4 * req.workers)))
+    chunks = [items[i:i+chunk] for i in range(0, len(items), chunk)]
+    with rank_pool_lock:
+        pool = get_rank_pool(req.workers)
+        futures = {pool.submit(evaluate_chunk, req, c): n for n, c in enumerate(chunks)}
+        results = [None] * len(chunks)
+        done_items = 0
+        pending = set(futures)
+        try:
+            report(progress, 0, len(items))
+            while pending:
+                finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    n = futures[future]
+                    results[n] = future.result()
+                    done_items += len(chunks[n])
+                report(progress, done_items, len(items))
+        except BrokenProcessPool:
+            rank_pool = None
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+    return [attributes for chunk_result in results for attributes in chunk_result]
+
+
+@instrument.timed("evaluate FoM", candidates=lambda r: 1)
+def evaluate_candidate(req, key, rst_ar, progress=None):
+    # progress: callback(fraction of this candidate done), only called by FoM (exact)
+    P = key_pitch(key); D = req.D * um; nx = math.floor(D / P)
+    phase_ideal_2d = gen_phase_map(req, P, D, num=nx)
+    phase_meta = set_metalens(req, rst_ar, phase_ideal_2d)
+    meanAR, meanT, FOM = get_attributes(req, rst_ar, phase_ideal_2d, phase_meta)
+    if req.sort_choice != "FoM (exact)":
+        return meanAR, meanT, FOM
+
+    phase_meta = refine_exact(req, rst_ar, phase_ideal_2d, phase_meta, progress)
+    return get_attributes(req, rst_ar, phase_ideal_2d, phase_meta)
+
+
+def r2_score(meta, ideal):
+    # Coefficient of determination of meta against ideal, as sklearn.metrics.r2_score(meta, ideal) computes it
+    # (1 for a constant exact match, 0 for any other constant map)
+    if meta.size < 2:
+        return float("nan")
+    dtype = np.result_type(meta, ideal, np.float32)     # float32 only when both maps are
+    meta = meta.astype(dtype, copy=False); ideal = ideal.astype(dtype, copy=False)
+    s_res = np.sum((meta - ideal)**2)
+    s_tot = np.sum((meta - np.mean(meta))**2)
+    if s_tot == 0:
+        return 1.0 if s_res == 0 else 0.0
+    return float(1 - s_res / s_tot)
+
+
+def r2_from_sums(n, s1, s2, s_res):
+    # r2_score(meta, ideal) from running sums: s1 = sum(meta), s2 = sum(meta^2), s_res = sum((meta - ideal)^2)
+    s_tot = s2 - s1 * s1 / n
+    if s_tot <= 0:
+        return 1.0 if s_res == 0 else 0.0
+    return 1 - s_res / s_tot
+
+
+def refine_exact(req, rst_ar, phase_ideal_2d, phase_meta, progress=None):
+    # Greedy phase replacement of FoM (exact): for every pixel of one octant, try each library phase within pi/18
+    # on its 8 symmetric pixels and keep it if the FoM rises. Only the R2 term of the FoM depends on the map,
+    # so it is tracked through running sums and each trial costs O(1) instead of a copy and a full r2_score.
+    # phase_meta is updated in place and returned.
+    w4 = req.weight[3]
+    if w4 == 0:
+        return phase_meta
+    nx = phase_ideal_2d.shape[0]
+    _, _, base = fom_base(req, rst_ar)
+    valid = ~np.isnan(phase_meta)
+    meta = phase_meta[valid].astype(np.float64); ideal = phase_ideal_2d[valid]
+    n = meta.size
+    s1 = math.fsum(meta); s2 = math.fsum(meta * meta); s_res = math.fsum((meta - ideal)**2)
+    FOM = base + w4 * r2_from_sums(n, s1, s2, s_res)
+
+    lib = rst_ar[:, req.phase_idx].astype(np.float64)
+    order = np.argsort(lib, kind='stable'); lib_sorted = lib[order]
+    tol = np.pi/18
+    half_nx = round(nx / 2)
+    for i in range(half_nx):
+        if progress is not None:
+            progress(i / half_nx)
+        for j in range(i, half_nx):
+            if ((i-(nx-1)/2)**2 + (j-(nx-1)/2)**2 > (nx/2)**2):    # Within the circle, and one half of the quadrant
+                continue
+            target = phase_ideal_2d[i, j]
+            lo = np.searchsorted(lib_sorted, target - 2*tol, 'left'); hi = np.searchsorted(lib_sorted, target + 2*tol, 'right')
+            within = [k for k in sorted(order[lo:hi]) if np.abs(target - lib[k]) < tol]
+            if not within:
+                continue
+            # The 8 symmetric pixels, without the duplicates on the diagonals
+            pixels = list(dict.fromkeys(zip((i, i, j, j, nx-1-i, nx-1-i, nx-1-j, nx-1-j),
+                                            (j, nx-1-j, i, nx-1-i, j, nx-1-j, i, nx-1-i))))
+            old = [float(phase_meta[px]) for px in pixels]
+            ref = [float(phase_ideal_2d[px]) for px in pixels]
+            m = len(pixels)
+            for k in within:
+                phase_k = lib[k]
+                t1 = s1 + m * phase_k - sum(old)
+                t2 = s2 + m * phase_k * phase_k - sum(o * o for o in old)
+                t_res = s_res + sum((phase_k - r)**2 - (o - r)**2 for o, r in zip(old, ref))
+                temp_FOM = base + w4 * r2_from_sums(n, t1, t2, t_res)
+                if temp_FOM > FOM:
+                    FOM = temp_FOM
+                    s1, s2, s_res = t1, t2, t_res
+                    old = [phase_k] * m
+                    for px in pixels:
+                        phase_meta[px] = phase_k
+    return phase_meta
+
+
+def rank_lines(req, sorted_rst_dict):
+    if req.pol == "Dependent":
+        return search_lines(req, sorted_rst_dict)
+    lines = []
+    for key in sorted_rst_dict.keys():
+        mat, fields = split_key(key)
+        if req.sort_choice == "Focusing":
+            lines.append(f'{mat},  H: {fields[0]} nm,  P: {fields[1]} nm,  mean AR: {fields[2]},  mean T: {fields[3]} %,  Strehl: {fields[4]},  FWHM: {fields[5]} nm,  Efficiency: {fields[6]} %')
+        else:
+            lines.append(f'{mat},  H: {fields[0]} nm,  P: {fields[1]} nm,  mean AR: {fields[2]},  mean T: {fields[3]} %,  FOM: {fields[4]}')
+    return lines
+
+
+def pick_candidate(req, rst_dict, index):
+    # Dependent: index counts meta-atoms over all materials / Independent: index counts (mat, H, P) libraries
+    if req.pol == "Dependent":
+        for key, rst in rst_dict.items():
+            if index < rst.shape[0]:
+                rst_ar = rst[index]
+                return rst_ar, key, float(rst_ar[1])
+            index -= rst.shape[0]
+        raise IndexError("Selected result is out of range")
+    key = list(rst_dict)[index]
+    return rst_dict[key], key, key_pitch(key)
+
+
+# ---------------------------------------------------------------- Layout
+@instrument.timed("phase map", pixels=np.size)
+def gen_phase_map(req, p, d, num=None, gap=None, radii=None):
+    wl = req.wl; f = req.f * um
+    if num is not None: # 2D phase map, evaluated on one octant of the top-left quadrant and mirrored
+        r = p * np.linspace(-(num-1)/2, (num-1)/2, num)
+        r2 = r[:(num+1)//2]**2
+        sq = f**2 + r2[np.newaxis, :] + r2[:, np.newaxis]     # f**2 + xv**2 + yv**2
+        required_phase = octant_apply(lambda s: wrap_phase(-2*math.pi / wl * (np.sqrt(s) - f)), sq)
+        required_phase[r2[np.newaxis, :] + r2[:, np.newaxis] > (d/2)**2] = np.nan
+        return unfold(required_phase, num)
+
+    elif gap is not None or radii is not None: # 1D phase map, on a regular grid or at the given radii
+        r = np.arange(-d/2, d/2+gap, gap) if radii is None else radii
+        required_phase = -2*math.pi / wl * (np.sqrt(f**2 + r**2) - f)
+    return wrap_phase(required_phase)
+
+
+def wrap_phase(phase):
+    phase = phase % (2*math.pi)
+    phase[phase > math.pi] -= 2 * math.pi
+    return phase
+
+
+# The lens grid r = p * linspace(-(n-1)/2, (n-1)/2, n) is exactly symmetric, so maps are mirror images in x and y
+# and only their top-left quadrant ((n+1)//2 square, centre row / column included) has to be computed.
+def unfold(quadrant, n):
+    # Full [n, n] map from its top-left quadrant
+    h = quadrant.shape[0]
+    full = np.empty((n, n), dtype=quadrant.dtype)
+    full[:h, :h] = quadrant
+    full[:h, h:] = quadrant[:, :n-h][:, ::-1]
+    full[h:] = full[:n-h][::-1]
+    return full
+
+
+def is_mirror_symmetric(m):
+    return m.ndim == 2 and m.shape[0] == m.shape[1] and \
+        np.array_equal(m, m[::-1], equal_nan=True) and np.array_equal(m, m[:, ::-1], equal_nan=True)
+
+
+def octant_apply(fn, quadrant, block=64):
+    # fn (elementwise) of a square quadrant, evaluated on and above the diagonal only. Below it, (i, j) reuses
+    # (j, i) wherever the two inputs are identical; x <-> y sums can differ in the last bit, those are recomputed.
+    h = quadrant.shape[0]
+    out = None
+    for i0 in range(0, h, block):
+        rows = fn(quadrant[i0:i0+block, i0:])
+        if out is None:
+            out = np.empty((h, h), dtype=rows.dtype)
+        out[i0:i0+block, i0:] = rows
+    lower = np.tri(h, k=-1, dtype=bool)
+    for i0 in range(0, h, block):
+        lower[i0:i0+block, i0:i0+block] = False     # already computed with their row block
+    transposed = quadrant.T
+    same = (quadrant == transposed)
+    if np.issubdtype(quadrant.dtype, np.floating):
+        same |= np.isnan(quadrant) & np.isnan(transposed)
+    reuse = lower & same; recompute = lower & ~same
+    out[reuse] = out.T[reuse]
+    if recompute.any():
+        out[recompute] = fn(quadrant[recompute])
+    return out
+
+
+@instrument.timed("assign atoms", pixels=lambda r: np.size(r[0] if isinstance(r, tuple) else r))
+def set_metalens(req, rst_ar, phase_ideal, get_idx=False):
+    if req.pol == "Dependent":
+        level = int(req.rotation_level)
+        phase_pb = np.round(phase_ideal / (2*math.pi/level)) * (2*math.pi/level)
+        return phase_pb
+
+    phase_lib = rst_ar[:, req.phase_idx]
+    nearest = atom_selector(req, rst_ar)
+    if is_mirror_symmetric(phase_ideal):
+        # Lens maps from gen_phase_map: assign one octant and mirror it
+        n = phase_ideal.shape[0]
+        arg_phase_real = unfold(octant_apply(lambda v: nearest(v.ravel()).reshape(v.shape),
+                                             phase_ideal[:(n+1)//2, :(n+1)//2]), n).ravel()
+    else:
+        arg_phase_real = nearest(phase_ideal.ravel()) # 2D: [N^2] / 1D: [N]
+    phase_real = phase_lib[arg_phase_real] # 2D: [N^2] / 1D: [N]
+    if phase_ideal.ndim == 2:
+        phase_real = phase_real.reshape(phase_ideal.shape)  # [N, N]
+        nan_i, nan_j = np.where(np.isnan(phase_ideal))
+        phase_real[nan_i, nan_j] = np.nan
+        if get_idx:
+            # 1-based index, 0 outside the aperture
+            arg_phase_real += 1
+            arg_phase_real = arg_phase_real.reshape(phase_ideal.shape)  # [N, N]
+            arg_phase_real[nan_i, nan_j] = 0
+            return phase_real, arg_phase_real
+    return phase_real
+
+
+def atom_selector(req, rst_ar):
+    # Maps a flat array of target phases to library row indices, by phase alone or by complex transmission
+    phase_lib = rst_ar[:, req.phase_idx]
+    if req.assignment == "Complex":
+        amplitude_lib = np.sqrt(np.maximum(rst_ar[:, req.phase_idx - 1], 0))
+        return lambda target: nearest_complex(target, amplitude_lib, phase_lib, req.amplitude_weight)
+    return lambda target: nearest_phase(target, phase_lib)
+
+
+def wrapped_diff(phase_ideal, phase_lib):
+    phase_diff = phase_ideal - phase_lib
+    phase_diff[phase_diff > math.pi] -= 2 * math.pi
+    phase_diff[phase_diff < - math.pi] += 2 * math.pi
+    return phase_diff
+
+
+def nearest_phase(phase_ideal, phase_lib, chunk=2**20):
+    # Index of the library phase closest to each target on the circle, lowest index on ties, like an argmin over
+    # the [pixels, M] wrapped difference matrix. The library phases are sorted once and each target only
+    # compares its two sorted neighbours and the two ends (the circular neighbours), so memory scales with pixels.
+    M = phase_lib.shape[0]
+    order = np.argsort(phase_lib, kind='stable')
+    phase_sorted = phase_lib[order]
+    # Sorted position of the first entry of each run of equal phases (= lowest library index among duplicates)
+    run_start = np.arange(M)
+    run_start[1:][phase_sorted[1:] == phase_sorted[:-1]] = 0
+    run_start = np.maximum.accumulate(run_start)
+    idx = np.empty(phase_ideal.shape[0], dtype=np.intp)
+    for s in range(0, phase_ideal.shape[0], chunk):
+        target = phase_ideal[s:s+chunk]
+        pos = np.searchsorted(phase_sorted, target)
+        best = order[run_start[np.minimum(pos, M-1)]]
+        best_diff = np.abs(wrapped_diff(target, phase_lib[best]))
+        for cand in (order[run_start[np.maximum(pos-1, 0)]], order[0], order[run_start[M-1]]):
+            diff = np.abs(wrapped_diff(target, phase_lib[cand]))
+            better = (diff < best_diff) | ((diff == best_diff) & (cand < best))
+            best[better] = cand[better] if np.ndim(cand) else cand
+            best_diff[better] = diff[better]
+        idx[s:s+chunk] = best
+    return idx
+
+
+def complex_points(amplitude, phase, weight):
+    # (a cos phase, a sin phase, sqrt(weight) a): squared distances are |a e^(i phase) - a' e^(i phase')|^2 + weight (a - a')^2
+    amplitude = np.broadcast_to(amplitude, np.shape(phase))
+    return np.column_stack([amplitude * np.cos(phase), amplitude * np.sin(phase), math.sqrt(weight) * amplitude])
+
+
+def complex_index(points):
+    # k-d tree of a library's complex_points, built once per library (None without scipy)
+    key = hashlib.blake2b(np.ascontiguousarray(points).data, digest_size=16).digest()
+    with complex_lock:
+        if key in complex_trees:
+            complex_trees.move_to_end(key)
+            return complex_trees[key]
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        return None
+    tree = cKDTree(points)
+    with complex_lock:
+        complex_trees[key] = tree
+        while len(complex_trees) > MAX_COMPLEX_TREES:
+            complex_trees.popitem(last=False)
+    return tree
+
+
+def nearest_complex(phase_ideal, amplitude_lib, phase_lib, weight=0.0, chunk=2**20):
+    # Index of the library atom whose complex transmission sqrt(T) e^(i phase) is closest to A e^(i phase_ideal), A being
+    # the largest amplitude of the library, so that every pixel asks for the best transmission available; weight > 0
+    # penalises the amplitude error further. All pixels are queried at once against the library's k-d tree.
+    points = complex_points(amplitude_lib, phase_lib, weight)
+    tree = complex_index(points)
+    A = float(amplitude_lib.max())
+    idx = np.empty(phase_ideal.shape[0], dtype=np.intp)
+    for s in range(0, phase_ideal.shape[0], chunk):
+        target = phase_ideal[s:s+chunk]
+        query = complex_points(A, np.where(np.isnan(target), 0, target), weight)     # nan: outside the aperture
+        if tree is not None:
+            idx[s:s+chunk] = tree.query(query, workers=-1)[1]
+            continue
+        # Without scipy: argmin over the library, in blocks of about 16M distances
+        step = max(1, 2**24 // points.shape[0])
+        for q in range(0, query.shape[0], step):
+            d2 = ((query[q:q+step, np.newaxis, :] - points[np.newaxis, :, :])**2).sum(axis=2)
+            idx[s+q:s+q+d2.shape[0]] = np.argmin(d2, axis=1)
+    return idx
+
+
+# For pol-independent
+def fom_base(req, rst_ar):
+    # Library-only part of the FoM: mean AR, mean T and the T, H and AR terms
+    if req.pol_value == 'Co-pol':
+        mean_AR = np.mean(rst_ar[:, 0] / rst_ar[:, 2])
+        mean_T = np.mean(rst_ar[:, 3])
+    elif req.pol_value == 'Cross-pol':
+        mean_AR = np.mean(rst_ar[:, 0] / np.min(rst_ar[:, [2,3]], axis=1))
+        mean_T = np.mean(rst_ar[:, 4])
+    H = rst_ar[0, 0] * 1e-9
+    w1, w2, w3, w4 = req.weight
+    return mean_AR, mean_T, w1 * mean_T + w2 * (1 - H/req.max_H) + w3 * (1 - mean_AR/req.max_AR)
+
+
+def get_attributes(req, rst_ar, phase_ideal, phase_meta):
+    mean_AR, mean_T, base = fom_base(req, rst_ar)
+    nonnan_phase_meta = phase_meta[~np.isnan(phase_meta)]
+    nonnan_phase_ideal = phase_ideal[~np.isnan(phase_ideal)]
+    R2 = r2_score(nonnan_phase_meta, nonnan_phase_ideal)
+    FOM = base + req.weight[3] * R2
+
+    return mean_AR, 100 * mean_T, FOM
+
+
+def make_layout(req, rst_ar, key, P):
+    D = req.D * um
+    num = math.floor(D / P)
+    xlin = P * np.linspace(-(num-1)/2, (num-1)/2, num)
+    phase_ideal = gen_phase_map(req, P, D, num=num)
+    if req.pol == "Dependent":
+        return Layout(rst_ar, key, P, num, xlin, phase_ideal, set_metalens(req, rst_ar, phase_ideal))
+    phase_meta, metaatom_idx = set_metalens(req, rst_ar, phase_ideal, get_idx=True)
+    # Set starting index to 0
+    return Layout(rst_ar, key, P, num, xlin, phase_ideal, phase_meta, metaatom_idx - 1)
+
+
+# ---------------------------------------------------------------- Propagation
+@instrument.timed("propagate radial", samples=lambda r: np.size(r[0]))
+def propagate_radial(req, rst_ar, P, progress=None):
+    # Rotationally symmetric propagation to z = f with a quasi-discrete Hankel transform of the radial profile
+    # (O(N^2) 1D work with N ~ D / P instead of 2D FFTs), for lenses too large for propagate. The profile is the
+    # 1D phase map at the transform radii, assigned by set_metalens, with unit amplitude like lens_field. Returns
+    # normalized |E| and the radii (m) within 20 wl / NA of the axis.
+    wl = req.wl; f = req.f * um; R = req.D * um / 2
+    r, _ = propagation.hankel_grid(math.ceil(2 * R / P), R)
+    phase_ideal = gen_phase_map(req, P, 2 * R, radii=r)
+    field = np.exp(1j * set_metalens(req, rst_ar, phase_ideal).astype(np.float64))
+    na = R / math.sqrt(f**2 + R**2)
+    rows = max(1, int(np.searchsorted(r, 20 * wl / na)))
+    E = propagation.propagate_radial(field, R, wl, f, rows=rows, progress=progress)
+    I = np.abs(E)
+    return I / np.max(I), r[:rows]
+
+
+def check_pitch(req, P):
+    if req.wl >= (P*math.sqrt(2)):
+        raise ValueError("The pitch size is to small for ASM propagation. Please select a lens with bigger pitch size.")
+
+
+def lens_field(req, rst_ar, P):
+    # Unit-amplitude field exp(i phase) of the metalens (0 phase outside the aperture) and its axis (m)
+    check_pitch(req, P)
+    D = req.D * um
+    nx = math.floor(D / P)
+    phase_ideal_2d = gen_phase_map(req, P, D, num=nx)
+    phase_map_2d = set_metalens(req, rst_ar, phase_ideal_2d)
+    phase_map_2d = np.where(np.isnan(phase_map_2d), 0, phase_map_2d)
+    field = np.exp(1j * phase_map_2d.astype(np.float32 if req.single_precision else np.float64))
+    # Coordinates in the spatial domain (original size)
+    x = np.linspace(-nx//2, nx//2 - 1, nx) * P
+    return field, x
+
+
+@instrument.timed("propagate", pixels=lambda r: np.size(r[0]))
+def propagate(req, rst_ar, P, progress=None):
+    # Angular spectrum propagation of the metalens phase to z = f; returns normalized |E| and the axis (m)
+    report(progress, 0, 4)
+    field, x = lens_field(req, rst_ar, P)
+    dtype = np.complex64 if req.single_precision else np.complex128
+    E = propagation.propagate_field(field, P, req.wl, req.f * um, dtype=dtype, progress=None if progress is None else lambda done, total: progress(1 + done, 4))
+    I = np.abs(E)
+    I_norm = I / np.max(I)
+    return I_norm, x
+
+
+@instrument.timed("focal scan", voxels=lambda r: np.size(r[0]))
+def focal_scan(req, rst_ar, P, z, path, progress=None):
+    # Intensity planes at every z (m) written to the .npy memmap at path ([len(z), n, n] float32).
+    # Returns the volume, the x axis, and the on-axis and xz-cut intensity normalized to the volume maximum.
+    field, x = lens_field(req, rst_ar, P)
+    nx = len(x)
+    volume = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(z), nx, nx))
+    dtype = np.complex64 if req.single_precision else np.complex128
+    propagation.propagate_stack(field, P, req.wl, z, volume, dtype=dtype, progress=progress)
+    volume.flush()
+    c = nx // 2     # x = 0
+    xz = np.array(volume[:, c, :])
+    peak = max(float(volume.max()), np.finfo(np.float32).tiny)
+    return volume, x, xz[:, c] / peak, xz / peak
+
+
+def scan_planes(req, num=64):
+    # Default focal scan: f +- 4 wl / NA^2 (a few depths of focus), kept in front of the lens
+    half = 4 * req.wl / req.na**2
+    f = req.f * um
+    return np.linspace(max(f - half, f / 20), f + half, num)
+
+
+def focal_metrics(z, axial):
+    # Focus position (peak of the on-axis intensity) and depth of focus (its FWHM), in the units of z
+    k = int(np.argmax(axial))
+    half = axial[k] / 2
+    lo = k
+    while lo > 0 and axial[lo - 1] >= half:
+        lo -= 1
+    hi = k
+    while hi < len(axial) - 1 and axial[hi + 1] >= half:
+        hi += 1
+    return z[k], z[hi] - z[lo]
+
+
+# ---------------------------------------------------------------- Focusing sort
+def transmitted_field(req, rst_ar, phase_ideal_2d):
+    # sqrt(T) exp(i phase) of the Independent layout, 0 outside the aperture
+    phase_meta, idx = set_metalens(req, rst_ar, phase_ideal_2d, get_idx=True)
+    T = rst_ar[:, req.phase_idx - 1].astype(np.float64)
+    amplitude = np.where(idx > 0, np.sqrt(T[idx - 1]), 0)
+    return amplitude * np.exp(1j * np.where(idx > 0, phase_meta, 0))
+
+
+def spot_fwhm(profile, P):
+    # Full width at half maximum (m) of a 1D intensity cut, with linear interpolation of both crossings
+    k = int(np.argmax(profile))
+    half = profile[k] / 2
+    lo = k
+    while lo > 0 and profile[lo - 1] >= half:
+        lo -= 1
+    hi = k
+    while hi < len(profile) - 1 and profile[hi + 1] >= half:
+        hi += 1
+    left = lo - (profile[lo] - half) / (profile[lo] - profile[lo - 1]) if lo > 0 else lo
+    right = hi + (profile[hi] - half) / (profile[hi] - profile[hi + 1]) if hi < len(profile) - 1 else hi
+    return (right - left) * P
+
+
+def spot_metrics(I, P, radius, incident, reference_peak):
+    # Focusing efficiency (power within radius of the peak / incident power), Strehl ratio (peak over the ideal
+    # lens peak, both per transmitted power) and FWHM (m) of the focal spot along x
+    i, j = np.unravel_index(np.argmax(I), I.shape)
+    r = np.arange(I.shape[0]) * P
+    inside = (r[:, np.newaxis] - r[i])**2 + (r[np.newaxis, :] - r[j])**2 <= radius**2
+    efficiency = float(I[inside].sum()) / incident
+    return efficiency, float(I[i, j]) / reference_peak, spot_fwhm(I[i], P)
+
+
+@instrument.timed("focusing sort", candidates=len)
+def rank_focusing(req, rst_dict, progress=None):
+    # "Focusing": every library's layout, with its transmission, is propagated to z = f and ranked by focusing
+    # efficiency. Libraries sharing a pitch share the transfer function and the ideal-lens reference, and are
+    # propagated in batches. The key becomes "mat-H-P-meanAR-meanT-Strehl-FWHM-Eff-numel" (FWHM in nm, Eff in %).
+    D = req.D * um; f = req.f * um
+    dtype = np.complex64 if req.single_precision else np.complex128
+    by_pitch = {}
+    for key in rst_dict:
+        by_pitch.setdefault(key_pitch(key), []).append(key)
+    num_key = len(rst_dict); done = 0
+    sorted_rst_dict = {}
+    for P, keys in by_pitch.items():
+        report(progress, done, num_key)
+        nx = math.floor(D / P)
+        phase_ideal_2d = gen_phase_map(req, P, D, num=nx)
+        aperture = ~np.isnan(phase_ideal_2d)
+        # Ideal lens: unit amplitude, exact phase; its spot sets the Strehl reference and the efficiency radius
+        ideal = np.where(aperture, np.exp(1j * np.where(aperture, phase_ideal_2d, 0)), 0)
+        incident = float(aperture.sum())
+        I = np.abs(propagation.propagate_field(ideal, P, req.wl, f, dtype=dtype))**2
+        reference_peak = float(I.max()) / incident
+        radius = 3 * spot_fwhm(I[np.unravel_index(np.argmax(I), I.shape)[0]], P)
+        batch = propagation.batch_size(nx, dtype=dtype)
+        for b0 in range(0, len(keys), batch):
+            group = keys[b0:b0+batch]
+            fields = [transmitted_field(req, rst_dict[key], phase_ideal_2d) for key in group]
+            for k, E in propagation.propagate_batch(fields, P, req.wl, f, dtype=dtype):
+                I = E.real.astype(np.float64)**2 + E.imag.astype(np.float64)**2
+                key = group[k]
+                rst_ar = rst_dict[key]
+                mean_AR, mean_T, _ = fom_base(req, rst_ar)
+                transmitted = float((np.abs(fields[k])**2).sum())
+                efficiency, strehl, fwhm = spot_metrics(I, P, radius, incident, reference_peak * transmitted)
+                numel = key.split("-")[-1]
+                new_key = f'{key[:-(len(numel)+1)]}-{float(mean_AR) :.1f}-{100*float(mean_T) :.1f}-{strehl :.4f}-{fwhm/nm :.0f}-{100*efficiency :.2f}-{numel}'
+                sorted_rst_dict[new_key] = rst_ar
+            done += len(group)
+            report(progress, done, num_key)
+    return OrderedDict(sorted(sorted_rst_dict.items(), key=lambda x: float(split_key(x[0])[1][-2]), reverse=True))
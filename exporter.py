@@ -0,0 +1,348 @@
+import os
+import re
+import math
+import numpy as np
+import instrument
+from engine import um, make_layout, report, split_key
+from gdsii import GDSWriter, MAX_COLROW
+from geometry import atom_polygons, lens_polygons
+
+GDS_ROWS = 64     # pixel rows per block of the text GDS
+
+
+def export_FDTD(req, layout, fname, progress=None):
+    f = open(fname, 'w')
+    D = req.D * um; fl = req.f * um; lam = req.wl
+    rst_ar = layout.rst_ar; phase_meta = layout.phase_meta
+    xlin = layout.xlin; ylin = np.copy(xlin); num = layout.num
+    mat = split_key(layout.key)[0]
+    mat = ''.join(mat.split(" "))
+    if req.pol == "Dependent":
+        cpval = req.pol_value
+        h = rst_ar[0]
+        l = rst_ar[2]
+        w = rst_ar[3]
+        for i in range(num):
+            report(progress, i, num)
+            for j in range(num):
+                if np.isnan(phase_meta[i,j]):
+                    continue
+                else:
+                    x = xlin[i]; y = ylin[j]
+                    f.write(f'addrect;')
+                    f.write(f'set("render type","wireframe");'); f.write(f'set("detail",0);')
+                    f.write(f'set("x", {x :.2e});'); f.write(f'set("x span", {l :.3e});')
+                    f.write(f'set("y", {y :.2e});'); f.write(f'set("y span", {w :.3e});')
+                    f.write(f'set("z min", {-h});'); f.write(f'set("z max", 0);')
+                    f.write(f'set("material","{mat}");')
+                    f.write(f'set("first axis","z");')
+                    if cpval == 'RCP':
+                        f.write(f'set("rotation 1", {-phase_meta[i, j] / 2});\n')
+                    elif cpval == 'LCP':
+                        f.write(f'set("rotation 1", {phase_meta[i, j] / 2});\n')
+
+    elif req.pol == "Independent":
+        co_cross = req.pol_value
+        h = int(split_key(layout.key)[1][0]) * 1e-9
+        metaatom_idx_2d = layout.idx
+        for i in range(num):
+            report(progress, i, num)
+            for j in range(num):
+                if np.isnan(phase_meta[i,j]):
+                    continue
+                else:
+                    x = xlin[i]; y = ylin[j]
+                    if co_cross == 'Co-pol':
+                        shape = rst_ar[metaatom_idx_2d[i, j], 5]
+                        l = rst_ar[metaatom_idx_2d[i, j], 2]
+                        if shape == 1:
+                            f.write(f'addcircle;')
+                            f.write(f'set("render type","wireframe");'); f.write(f'set("detail",0);')
+                            f.write(f'set("x", {x :.2e});'); f.write(f'set("y", {y :.2e});')
+                            f.write(f'set("radius", {l/2 :.3e});')
+                        elif shape == 2:
+                            f.write(f'addrect;')
+                            f.write(f'set("render type","wireframe");'); f.write(f'set("detail",0);')
+                            f.write(f'set("x",{x :.2e});'); f.write(f'set("x span", {l :.3e});')
+                            f.write(f'set("y",{y :.2e});'); f.write(f'set("y span", {l :.3e});')
+                        f.write(f'set("z min", {-h});'); f.write(f'set("z max", 0);')
+                        f.write(f'set("material","{mat}");')
+
+                    elif co_cross == 'Cross-pol':
+                        l = rst_ar[metaatom_idx_2d[i, j], 2]
+                        w = rst_ar[metaatom_idx_2d[i, j], 3]
+                        f.write(f'addrect;')
+                        f.write(f'set("render type","wireframe");'); f.write(f'set("detail",0);')
+                        f.write(f'set("x",{x :.2e});'); f.write(f'set("x span", {l :.3e});')
+                        f.write(f'set("y",{y :.2e});'); f.write(f'set("y span", {w :.3e});')
+                        f.write(f'set("z min", {-h});'); f.write(f'set("z max", 0);')
+                        f.write(f'set("material","{mat}");')
+                        f.write(f'set("first axis","z");')
+
+    write_FDTD_setup(f, fname, D, fl, lam, h)
+    f.close()
+    return [fname]
+
+
+def export_FDTD_compact(req, layout, fname, progress=None):
+    # Same structures as export_FDTD from two matrices: the distinct atoms inline in the script and one
+    # "i j atom" row per pillar in "<name>_pillars.txt" (next to the script), created by a script loop
+    D = req.D * um; fl = req.f * um; lam = req.wl
+    rst_ar = layout.rst_ar; phase_meta = layout.phase_meta; num = layout.num
+    mat = split_key(layout.key)[0]
+    mat = ''.join(mat.split(" "))
+    report(progress, 0, 2)
+    i, j = np.nonzero(~np.isnan(phase_meta))
+    if req.pol == "Dependent":
+        h = rst_ar[0]
+        rotation = -phase_meta[i, j] / 2 if req.pol_value == 'RCP' else phase_meta[i, j] / 2
+        table, atom = np.unique(rotation, return_inverse=True)
+        columns = 'rotation 1'
+        pillar = ['addrect;', 'set("render type","wireframe"); set("detail",0);',
+                  'set("x", x); set("x span", %.3e);' % rst_ar[2], 'set("y", y); set("y span", %.3e);' % rst_ar[3],
+                  f'set("z min", {-h}); set("z max", 0);', f'set("material","{mat}");',
+                  'set("first axis","z"); set("rotation 1", atoms(a,1));']
+    else:
+        h = int(split_key(layout.key)[1][0]) * 1e-9
+        used, atom = np.unique(layout.idx[i, j], return_inverse=True)
+        if req.pol_value == 'Co-pol':
+            table = rst_ar[used][:, [2, 5]]
+            columns = 'diameter / side, shape (1 circle, 2 square)'
+            pillar = ['if (atoms(a,2) == 1) {', '    addcircle;', '    set("render type","wireframe"); set("detail",0);',
+                      '    set("x", x); set("y", y); set("radius", atoms(a,1)/2);', '} else {',
+                      '    addrect;', '    set("render type","wireframe"); set("detail",0);',
+                      '    set("x", x); set("x span", atoms(a,1));', '    set("y", y); set("y span", atoms(a,1));', '}',
+                      f'set("z min", {-h}); set("z max", 0);', f'set("material","{mat}");']
+        elif req.pol_value == 'Cross-pol':
+            table = rst_ar[used][:, [2, 3]]
+            columns = 'x span, y span'
+            pillar = ['addrect;', 'set("render type","wireframe"); set("detail",0);',
+                      'set("x", x); set("x span", atoms(a,1));', 'set("y", y); set("y span", atoms(a,2));',
+                      f'set("z min", {-h}); set("z max", 0);', f'set("material","{mat}");', 'set("first axis","z");']
+    table = np.asarray(table, dtype=np.float64).reshape(len(table), -1)
+    data_name = os.path.splitext(fname)[0] + "_pillars.txt"
+    # 1-based pixel and atom indices
+    np.savetxt(data_name, np.column_stack([i + 1, j + 1, atom.ravel() + 1]).reshape(-1, 3), fmt='%d', delimiter='\t')
+    report(progress, 1, 2)
+
+    f = open(fname, 'w')
+    f.write(f'P = {layout.P :.6e}; n = {num};\n')
+    f.write(f'# Distinct atoms, one row each: {columns}\n')
+    f.write('atoms = [' + '; '.join(', '.join(f'{v :.6e}' for v in row) for row in table) + '];\n')
+    f.write(f'# One row per pillar in {os.path.basename(data_name)} (same folder as this script): i, j, atom\n')
+    # readdata resolves relative paths against the working directory, not the script's folder
+    f.write(f'workdir = pwd; cd(filedirectory(currentscriptname));\n')
+    f.write(f'pillars = readdata("{os.path.basename(data_name)}");\n')
+    f.write(f'cd(workdir);\n')
+    f.write(f'for (k = 1:size(pillars, 1)) {{\n')
+    f.write(f'    x = (pillars(k,1) - (n+1)/2) * P; y = (pillars(k,2) - (n+1)/2) * P; a = pillars(k,3);\n')
+    for line in pillar:
+        f.write(f'    {line}\n')
+    f.write(f'}}\n')
+    write_FDTD_setup(f, fname, D, fl, lam, h)
+    f.close()
+    return [fname, data_name]
+
+
+def write_FDTD_setup(f, fname, D, fl, lam, h):
+    f.write(f'\nselect("FDTD");\n')
+    f.write(f'set("x span", {D :.4e});\n'); f.write(f'set("y span", {D :.4e});\n')
+    f.write(f'set("z max", {fl + 1.5 * lam :.2e});\n')
+    f.write(f'set("z min", {-h - 5 * lam :.2e});\n\n')
+
+    f.write(f'select("substrate");\n')
+    f.write(f'set("x span", {2*D :.4e});\n'); f.write(f'set("y span", {2*D :.4e});\n')
+    f.write(f'set("z max", {-h :.2e});\n'); f.write(f'set("z min", {-h - 3 *lam :.2e});\n\n')
+
+    f.write(f'select("source_x");\n')
+    f.write(f'set("enabled",1);\n')
+    f.write(f'set("x span",{D*2 :.4e});\n'); f.write(f'set("y span", {2*D :.4e});\n')
+    f.write(f'set("z", {-h-lam :.2e});\n')
+    f.write(f'set("center wavelength", {lam});\n')
+    f.write(f'setglobalsource("center wavelength", {lam*1e9});\n\n')
+
+    f.write(f'select("source_y");\n')
+    f.write(f'set("enabled",0);\n')
+    f.write(f'set("x span", {D*2 :.4e});\n'); f.write(f'set("y span", {D*2 :.4e});\n')
+    f.write(f'set("z", {-h-lam :.2e});\n')
+    f.write(f'set("center wavelength", {lam});\n')
+    f.write(f'setglobalsource("center wavelength", {lam});\n\n')
+
+    f.write(f'select("monitor_xy");\n')
+    f.write(f'set("x span", {D :.4e});\n'); f.write(f'set("y span", {D :.4e});\n')
+    f.write(f'set("z",{fl});\n\n')
+
+    f.write(f'select("monitor_xz");\n')
+    f.write(f'set("x span",{D :.4e});\n')
+    f.write(f'set("z max", {fl + 1.5* lam});\n')
+    f.write(f'set("z min", {-h-lam*5});\n\n')
+
+    f.write(f'save("{fname}");\n')
+    f.write(f'save("{fname + "_x"}");\n\n')
+
+    f.write(f'select("source_x");\n')
+    f.write(f'set("enabled",0);\n')
+    f.write(f'select("source_y");\n')
+    f.write(f'set("enabled",1);\n')
+    f.write(f'save("{fname + "_y"}");\n\n')
+    f.write(f'addjob("{fname+"_x"}");\n'); f.write(f'addjob("{fname+"_y"}");\n')
+    f.write(f'runjobs;\n')
+
+
+def virtuallab_maps(req, layout):
+    # Phase and |t|^2 of every pixel (0 outside the aperture)
+    rst_ar = layout.rst_ar; phase_meta = layout.phase_meta; num = layout.num
+    inside = ~np.isnan(phase_meta)
+    export_phase = np.zeros([num, num])
+    export_T = np.zeros([num, num])
+    if req.pol == "Dependent":
+        export_phase[inside] = phase_meta[inside] + rst_ar[5]
+        export_T[inside] = rst_ar[4]
+        export_phase[export_phase > math.pi] -= 2 * math.pi
+        export_phase[export_phase < -math.pi] += 2 * math.pi
+
+    elif req.pol == "Independent":
+        idx_T = 3 if req.pol_value == 'Co-pol' else 4
+        export_phase[inside] = phase_meta[inside]
+        export_T[inside] = rst_ar[layout.idx[inside], idx_T]
+    return export_phase, export_T
+
+
+def export_VirtualLab(req, layout, fname, progress=None):
+    # fname: path without extension, "_phase.txt" / "_abs^2.txt" are appended
+    export_phase, export_T = virtuallab_maps(req, layout)
+    report(progress, 1, 3)
+    np.savetxt(fname + "_phase.txt", export_phase, fmt='%.4f', delimiter='\t')
+    report(progress, 2, 3)
+    np.savetxt(fname + "_abs^2.txt", export_T, fmt='%.4f', delimiter='\t')
+    return [fname + "_phase.txt", fname + "_abs^2.txt"]
+
+
+def export_VirtualLab_npy(req, layout, fname, progress=None):
+    # "_phase.npy" / "_abs^2.npy", float32
+    export_phase, export_T = virtuallab_maps(req, layout)
+    report(progress, 1, 2)
+    np.save(fname + "_phase.npy", export_phase.astype(np.float32))
+    np.save(fname + "_abs^2.npy", export_T.astype(np.float32))
+    return [fname + "_phase.npy", fname + "_abs^2.npy"]
+
+
+def export_VirtualLab_raw(req, layout, fname, progress=None):
+    # "_phase.f32" / "_abs^2.f32": headerless little-endian float32, num x num, row-major
+    export_phase, export_T = virtuallab_maps(req, layout)
+    report(progress, 1, 2)
+    export_phase.astype('<f4').tofile(fname + "_phase.f32")
+    export_T.astype('<f4').tofile(fname + "_abs^2.f32")
+    return [fname + "_phase.f32", fname + "_abs^2.f32"]
+
+
+def export_VirtualLab_h5(req, layout, fname, progress=None):
+    # ".h5" with chunked, compressed float32 datasets "phase" and "abs^2"
+    import h5py
+    export_phase, export_T = virtuallab_maps(req, layout)
+    report(progress, 1, 2)
+    chunk = min(layout.num, 1024)
+    with h5py.File(fname + ".h5", "w") as f:
+        for name, data in [("phase", export_phase), ("abs^2", export_T)]:
+            f.create_dataset(name, data=data.astype(np.float32), chunks=(chunk, chunk), compression="gzip", compression_opts=1)
+        f.attrs["pitch"] = layout.P
+        f.attrs["wavelength"] = req.wl
+    return [fname + ".h5"]
+
+
+def export_GDS(req, layout, fname, progress=None):
+    num = layout.num
+    f = open(fname, 'w')
+    f.write(f'HEADER 3;\n')
+    f.write(f'BGNLIB;\n')
+    f.write(f'LIBNAME {fname};\n')
+    f.write(f'UNITS 1.000000e+000 1.000000e-009;\n')
+    f.write(f'BGNSTR;\n')
+    f.write(f'STRNAME {fname[:-4]};\n')
+    # Vertices come from the geometry stage a block of pixel rows at a time and are written in pixel order
+    for i0 in range(0, num, GDS_ROWS):
+        report(progress, i0, num)
+        f.write(boundary_text(lens_polygons(req, layout, slice(i0, min(i0 + GDS_ROWS, num)))))
+    f.write(f'ENDSTR\n')
+    f.write(f'ENDLIB\n')
+    f.close()
+    return [fname]
+
+
+def boundary_text(groups):
+    pixels = []; texts = []
+    for pix, vertices in groups:
+        template = 'BOUNDARY\nLAYER 46;\nDATATYPE 46;\nXY\n' + '%d\t:\t%d\n' * vertices.shape[1] + 'ENDEL\n'
+        texts += [template % tuple(v) for v in vertices.reshape(len(vertices), -1).tolist()]
+        pixels.append(pix)
+    if not pixels:
+        return ''
+    return ''.join([texts[k] for k in np.argsort(np.concatenate(pixels), kind='stable')])
+
+
+def export_GDSII(req, layout, fname, progress=None):
+    # Binary GDSII: one cell per distinct meta-atom (per rotation in Dependent), placed in the top cell with
+    # an AREF per run of equal atoms along y and an SREF for single atoms
+    rst_ar = layout.rst_ar; phase_meta = layout.phase_meta; num = layout.num; P = layout.P
+    inside = ~np.isnan(phase_meta)
+    # Distinct atoms: PB phases (Dependent) or library rows (Independent), drawn at the origin
+    distinct, atom = np.unique(phase_meta[inside] if req.pol == "Dependent" else layout.idx[inside], return_inverse=True)
+    polygons = [None] * len(distinct)
+    zeros = np.zeros(len(distinct))
+    for members, vertices in atom_polygons(req, rst_ar, P, zeros, zeros, distinct):
+        for k, xy in zip(members, vertices):
+            polygons[k] = xy
+    cells = np.full((num, num), -1); cells[inside] = atom.ravel()
+
+    grid = np.floor(1e9 * P * np.linspace(-(num-1)/2, (num-1)/2, num) + 0.5).astype(np.int64)
+    pitch = grid[1] - grid[0] if num > 1 else 0
+    # Runs of equal atoms along each row (x = grid[i], y = grid[j]); one atom per run if the rounded grid is uneven
+    start = np.ones((num, num), dtype=bool)
+    if num > 1 and np.all(np.diff(grid) == pitch):
+        start[:, 1:] = cells[:, 1:] != cells[:, :-1]
+    run_i, run_j = np.nonzero(start)
+    run_len = np.diff(np.append(run_i * num + run_j, num * num))
+    keep = cells[run_i, run_j] >= 0
+    run_i, run_j, run_len = run_i[keep], run_j[keep], run_len[keep]
+    parts = -(-run_len // MAX_COLROW)
+    offset = (np.arange(parts.sum()) - np.repeat(np.cumsum(parts) - parts, parts)) * MAX_COLROW
+    run_i = np.repeat(run_i, parts); run_j = np.repeat(run_j, parts) + offset
+    run_len = np.minimum(np.repeat(run_len, parts) - offset, MAX_COLROW)
+    run_cell = cells[run_i, run_j]
+
+    top = re.sub(r'[^A-Za-z0-9_?$]', '_', os.path.splitext(os.path.basename(fname))[0]) or 'TOP'
+    with open(fname, 'wb') as f:
+        gds = GDSWriter(f, top)
+        names = [f'ATOM_{k}' for k in range(len(polygons))]
+        for name, xy in zip(names, polygons):
+            xy = xy[np.append(True, np.any(xy[1:] != xy[:-1], axis=1))]    # drop repeated vertices
+            gds.begin_cell(name); gds.boundary(xy); gds.end_cell()
+        gds.begin_cell(top)
+        for k, name in enumerate(names):
+            report(progress, k, len(names))
+            single = (run_cell == k) & (run_len == 1); multi = (run_cell == k) & (run_len > 1)
+            if single.any():
+                gds.srefs(name, np.column_stack([grid[run_i[single]], grid[run_j[single]]]))
+            if multi.any():
+                gds.arefs(name, np.column_stack([grid[run_i[multi]], grid[run_j[multi]]]),
+                          np.column_stack([np.ones(multi.sum(), dtype=np.int64), run_len[multi]]), (pitch, pitch))
+        gds.end_cell()
+        gds.close()
+    return [fname]
+
+
+EXPORTERS = {"lsf": (export_FDTD, ".lsf"), "lsfc": (export_FDTD_compact, ".lsf"), "vl": (export_VirtualLab, ""), "vlnpy": (export_VirtualLab_npy, ""),
+             "vlraw": (export_VirtualLab_raw, ""), "vlh5": (export_VirtualLab_h5, ""), "gds": (export_GDSII, ".gds"), "gdstxt": (export_GDS, ".txt")}
+
+
+def export(req, layout, name, fmt, progress=None):
+    writer, ext = EXPORTERS[fmt]
+    fname = req.exportdir + name + ext
+    with instrument.stage(f"export {fmt}", atoms=int(np.count_nonzero(~np.isnan(layout.phase_meta)))) as rec:
+        # Writers return the paths of the files they wrote
+        rec["bytes"] = sum(os.path.getsize(path) for path in writer(req, layout, fname, progress))
+    return fname
+
+
+def export_design(req, rst_ar, key, P, name, fmt, progress=None):
+    return export(req, make_layout(req, rst_ar, key, P), name, fmt, progress)
@@ -0,0 +1,93 @@
+import struct
+import time
+import numpy as np
+
+# GDSII stream record types (record type << 8 | data type)
+HEADER = 0x0002; BGNLIB = 0x0102; LIBNAME = 0x0206; UNITS = 0x0305; ENDLIB = 0x0400
+BGNSTR = 0x0502; STRNAME = 0x0606; ENDSTR = 0x0700
+BOUNDARY = 0x0800; SREF = 0x0A00; AREF = 0x0B00; ENDEL = 0x1100
+LAYER = 0x0D02; DATATYPE = 0x0E02; XY = 0x1003; SNAME = 0x1206; COLROW = 0x1302
+MAX_COLROW = 32767
+
+
+def real8(value):
+    # 8-byte excess-64, base-16 GDSII real
+    if value == 0:
+        return bytes(8)
+    sign = 0x80 if value < 0 else 0
+    value = abs(value); exponent = 64
+    while value >= 1:
+        value /= 16; exponent += 1
+    while value < 1/16:
+        value *= 16; exponent -= 1
+    mantissa = int(round(value * 2**56))
+    if mantissa >= 2**56:
+        mantissa //= 16; exponent += 1
+    return bytes([sign | exponent]) + mantissa.to_bytes(7, 'big')
+
+
+def string(s):
+    data = s.encode('ascii')
+    return data + b'\0' if len(data) % 2 else data
+
+
+def record(rtype, data=b''):
+    return struct.pack('>HH', 4 + len(data), rtype) + data
+
+
+def timestamp():
+    t = time.localtime()
+    return struct.pack('>6h', t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec) * 2
+
+
+class GDSWriter:
+    # Binary GDSII stream. Coordinates are integers in database units (db_unit metres, user unit = um).
+    def __init__(self, f, libname, db_unit=1e-9, user_unit=1e-6):
+        self.f = f
+        f.write(record(HEADER, struct.pack('>h', 600)))
+        f.write(record(BGNLIB, timestamp()))
+        f.write(record(LIBNAME, string(libname)))
+        f.write(record(UNITS, real8(db_unit / user_unit) + real8(db_unit)))
+
+    def begin_cell(self, name):
+        self.f.write(record(BGNSTR, timestamp()))
+        self.f.write(record(STRNAME, string(name)))
+
+    def end_cell(self):
+        self.f.write(record(ENDSTR))
+
+    def boundary(self, xy, layer=46, datatype=46):
+        # xy: [V, 2] closed polygon (first point repeated at the end)
+        self.f.write(record(BOUNDARY))
+        self.f.write(record(LAYER, struct.pack('>h', layer)))
+        self.f.write(record(DATATYPE, struct.pack('>h', datatype)))
+        self.f.write(record(XY, np.asarray(xy, dtype='>i4').tobytes()))
+        self.f.write(record(ENDEL))
+
+    def srefs(self, name, origin):
+        # One SREF of cell name per row of origin [K, 2], written as a single block
+        sname = string(name)
+        rec = np.empty(len(origin), dtype=[('sref', '>u2', 2), ('sname', '>u2', 2), ('name', f'S{len(sname)}'),
+                                           ('xy', '>u2', 2), ('origin', '>i4', 2), ('endel', '>u2', 2)])
+        rec['sref'] = (4, SREF); rec['sname'] = (4 + len(sname), SNAME); rec['name'] = sname
+        rec['xy'] = (12, XY); rec['origin'] = origin; rec['endel'] = (4, ENDEL)
+        self.f.write(rec.tobytes())
+
+    def arefs(self, name, origin, colrow, pitch):
+        # One AREF per row of origin [K, 2] with colrow [K, 2] (columns along x, rows along y) and pitch (dx, dy)
+        sname = string(name)
+        origin = np.asarray(origin, dtype=np.int64); colrow = np.asarray(colrow, dtype=np.int64)
+        rec = np.empty(len(origin), dtype=[('aref', '>u2', 2), ('sname', '>u2', 2), ('name', f'S{len(sname)}'),
+                                           ('colrow', '>u2', 2), ('counts', '>i2', 2),
+                                           ('xy', '>u2', 2), ('points', '>i4', 6), ('endel', '>u2', 2)])
+        rec['aref'] = (4, AREF); rec['sname'] = (4 + len(sname), SNAME); rec['name'] = sname
+        rec['colrow'] = (8, COLROW); rec['counts'] = colrow
+        rec['xy'] = (28, XY)
+        rec['points'] = np.column_stack([origin[:, 0], origin[:, 1],
+                                         origin[:, 0] + colrow[:, 0] * pitch[0], origin[:, 1],
+                                         origin[:, 0], origin[:, 1] + colrow[:, 1] * pitch[1]])
+        rec['endel'] = (4, ENDEL)
+        self.f.write(rec.tobytes())
+
+    def close(self):
+        self.f.write(record(ENDLIB))
@@ -0,0 +1,109 @@
+import math
+import numpy as np
+
+# Polygon vertices of meta-atoms, batched per shape as [atoms, vertices, 2] int64 arrays (nm), rounded the way the
+# text GDS has always been written. The arithmetic (operand order, float32 library values) follows the original
+# per-pixel export so that every vertex comes out the same.
+
+
+def frame(x, y, P):
+    # Reverse GDS: pixel frame entered and left at the centre of its top edge, [n, 6, 2]
+    half = P/2*1e9
+    xs = [x, x + half, x + half, x - half, x - half, x]
+    ys = [y + half, y + half, y - half, y - half, y + half, y + half]
+    return np.stack([np.stack(xs, 1), np.stack(ys, 1)], 2)
+
+
+def stack(xs, ys):
+    return np.rint(np.stack([np.stack(xs, 1), np.stack(ys, 1)], 2)).astype(np.int64)
+
+
+def rotated_rects(req, rst_ar, P, x, y, alpha):
+    # Dependent: the library rectangle rotated by alpha (PB phase / 2) at every atom
+    l = rst_ar[2] * 1e9; w = rst_ar[3] * 1e9
+    xh = l/2; yh = w/2
+    corners = [(-xh, yh), (-xh, -yh), (xh, -yh), (xh, yh)]
+    # Few distinct rotations: corner offsets with scalar math.cos / math.sin, then gathered per atom
+    alphas, rot = np.unique(alpha, return_inverse=True)
+    off = np.array([[(x1*math.cos(a) - y1*math.sin(a), x1*math.sin(a) + y1*math.cos(a)) for x1, y1 in corners]
+                    for a in alphas]).reshape(len(alphas), 4, 2)[rot.ravel()]
+    X = off[:, :, 0] + x[:, None]; Y = off[:, :, 1] + y[:, None]
+    xs = [X[:, k] for k in range(4)] + [X[:, 0]]
+    ys = [Y[:, k] for k in range(4)] + [Y[:, 0]]
+    if req.reverse_gds:
+        top = y + P/2*1e9
+        fr = frame(x, y, P)
+        xs = [X[:, 0]] + xs + [X[:, 0]] + [fr[:, k, 0] for k in range(1, 5)] + [X[:, 0]]
+        ys = [top] + ys + [top] + [fr[:, k, 1] for k in range(1, 5)] + [top]
+    return stack(xs, ys)
+
+
+def rects(req, rst_ar, P, x, y, idx):
+    # Cross-pol: axis-aligned L x W rectangles
+    l = (rst_ar[idx, 2]) * 1e9; w = (rst_ar[idx, 3]) * 1e9
+    xh = l/2; yh = w/2
+    xs = [x + (-xh), x + (-xh), x + xh, x + xh]
+    ys = [y + yh, y + (-yh), y + (-yh), y + yh]
+    if req.reverse_gds:
+        fr = frame(x, y, P)
+        xs += [x] + [fr[:, k, 0] for k in range(6)] + [x]
+        ys += [y + yh] + [fr[:, k, 1] for k in range(6)] + [y + yh]
+    return stack(xs + [xs[0]], ys + [ys[0]])
+
+
+def circles(req, rst_ar, P, x, y, idx):
+    # Co-pol circles: 16-gon walked edge by edge from the top, starting from a rounded vertex
+    atom_D = rst_ar[idx, 2] * 1e9
+    theta = 2*math.pi/16
+    l = atom_D*math.tan(theta/2)
+    top = y + atom_D/2
+    xs = [x, x - l/2]; ys = [top, top]
+    x_temp = np.rint(x - l/2); y_temp = np.rint(top)
+    for k in range(1, 14+1):
+        xs.append(x_temp - l*math.cos(theta*k)); ys.append(y_temp - l*math.sin(theta*k))
+        x_temp = xs[-1]; y_temp = ys[-1]
+    xs += [x + l/2, x]; ys += [top, top]
+    if req.reverse_gds:
+        fr = frame(x, y, P)
+        xs += [fr[:, k, 0] for k in range(6)]; ys += [fr[:, k, 1] for k in range(6)]
+    return stack(xs + [x], ys + [top])
+
+
+def squares(req, rst_ar, P, x, y, idx):
+    atom_L = rst_ar[idx, 2] * 1e9
+    xs = [x, x - atom_L/2, x - atom_L/2, x + atom_L/2, x + atom_L/2, x]
+    ys = [y + atom_L/2, y + atom_L/2, y - atom_L/2, y - atom_L/2, y + atom_L/2, y + atom_L/2]
+    if req.reverse_gds:
+        fr = frame(x, y, P)
+        xs += [fr[:, k, 0] for k in range(6)]; ys += [fr[:, k, 1] for k in range(6)]
+    return stack(xs + [x], ys + [y + atom_L/2])
+
+
+def atom_polygons(req, rst_ar, P, x, y, atom):
+    # Polygons of atoms centred at x, y (nm). atom: PB phase (Dependent) or library row (Independent) of each.
+    # Returns [(members, vertices)]: members indexes the atoms of one shape, vertices is [len(members), V, 2]
+    x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64); atom = np.asarray(atom)
+    if req.pol == "Dependent":
+        alpha = -atom/2 if req.pol_value == 'RCP' else atom/2
+        return [(np.arange(len(x)), rotated_rects(req, rst_ar, P, x, y, alpha))]
+    if req.pol_value == 'Cross-pol':
+        return [(np.arange(len(x)), rects(req, rst_ar, P, x, y, atom))]
+    groups = []
+    for shape, draw in [(1, circles), (2, squares)]:
+        members = np.flatnonzero(rst_ar[atom, 5] == shape)
+        if len(members):
+            groups.append((members, draw(req, rst_ar, P, x[members], y[members], atom[members])))
+    return groups
+
+
+def lens_polygons(req, layout, rows=None):
+    # Polygons of every atom of the lens (or of the pixel rows in the slice rows), with the row-major pixel
+    # index of each atom: [(pixels, vertices)]
+    num = layout.num; P = layout.P
+    xlin = 1e9 * P * np.linspace(-(num-1)/2, (num-1)/2, num)
+    rows = rows or slice(0, num)
+    inside = ~np.isnan(layout.phase_meta[rows])
+    pixels = np.flatnonzero(inside) + rows.start * num
+    i, j = np.divmod(pixels, num)
+    atom = layout.phase_meta[i, j] if req.pol == "Dependent" else layout.idx[i, j]
+    return [(pixels[members], vertices) for members, vertices in atom_polygons(req, layout.rst_ar, P, xlin[i], xlin[j], atom)]
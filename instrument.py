@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import threading
+import functools
+import numbers
+from collections import deque
+from contextlib import contextmanager
+
+# Per-stage timing and memory records of the engine and the exporters.
+#
+#   with instrument.stage("filter", rows=rst.shape[0]) as rec:
+#       ...
+#       rec["kept"] = kept
+#
+# or, for a whole function, @instrument.timed("phase map", pixels=lambda result: result.size).
+#
+# Every record gets wall_s, the resident memory at the end (rss_mb) and the highest resident memory sampled
+# while the stage ran (peak_mb); each numeric count also gets a <count>_per_s rate. Records are kept in memory
+# (recorder.since / summarize) and appended to a JSON-lines file when a log is set (recorder.set_log).
+
+
+def memory_rss():
+    # Resident memory of this process in bytes, None where it cannot be read
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        if sys.platform == "win32":
+            import ctypes
+            from ctypes import wintypes
+
+            class Counters(ctypes.Structure):
+                _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+            counters = Counters(); counters.cb = ctypes.sizeof(Counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+            return None
+        import resource
+        # macOS: only the lifetime peak is available (bytes there, KiB on other Unixes)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (OSError, ValueError, AttributeError, ImportError):
+        return None
+
+
+class Recorder:
+    def __init__(self, keep=20000, interval=0.02):
+        self.records = deque(maxlen=keep)
+        self.serial = 0
+        self.interval = interval       # memory sampling period (s) while a stage runs
+        self.active = {}               # id -> [peak bytes] of every open stage
+        self.sampler = None
+        self.log_path = None
+        self.lock = threading.Lock()
+
+    def set_log(self, path):
+        # JSON-lines file every later record is appended to (None stops logging)
+        self.log_path = path
+
+    def mark(self):
+        # Serial number of the last record; since(mark) returns what was recorded after it
+        return self.serial
+
+    def since(self, mark):
+        with self.lock:
+            return [rec for rec in self.records if rec["seq"] > mark]
+
+    @contextmanager
+    def stage(self, name, **counts):
+        rec = dict(stage=name, **counts)
+        peak = [memory_rss() or 0]
+        with self.lock:
+            self.active[id(peak)] = peak
+            if self.sampler is None or not self.sampler.is_alive():
+                self.sampler = threading.Thread(target=self.sample, daemon=True)
+                self.sampler.start()
+        t = time.perf_counter()
+        try:
+            yield rec
+        except BaseException as e:
+            rec["failed"] = type(e).__name__
+            raise
+        finally:
+            wall = time.perf_counter() - t
+            with self.lock:
+                del self.active[id(peak)]
+            rss = memory_rss() or 0
+            rec.update(wall_s=wall, rss_mb=rss / 2**20, peak_mb=max(peak[0], rss) / 2**20)
+            for key, value in list(rec.items()):
+                if key not in ("stage", "wall_s", "rss_mb", "peak_mb") and isinstance(value, numbers.Real) and not isinstance(value, bool):
+                    rec[key] = value = value.item() if hasattr(value, "item") else value    # numpy scalars -> JSON
+                    rec[f"{key}_per_s"] = value / wall if wall > 0 else None
+            self.add(rec)
+
+    def add(self, rec):
+        with self.lock:
+            self.serial += 1
+            rec["seq"] = self.serial
+            rec["time"] = time.time()
+            self.records.append(rec)
+            path = self.log_path
+        if path is not None:
+            try:
+                with open(path, "a") as f:
+                    f.write(json.dumps(rec) + "\n")
+            except OSError:
+                self.log_path = None
+
+    def sample(self):
+        # Runs while any stage is open; raises the peak of every open stage
+        while True:
+            rss = memory_rss()
+            with self.lock:
+                if not self.active:
+                    self.sampler = None
+                    return
+                if rss is not None:
+                    for peak in self.active.values():
+                        peak[0] = max(peak[0], rss)
+            time.sleep(self.interval)
+
+
+def summarize(records):
+    # One row per stage name: calls, total wall time, highest peak and the summed counts with their rates
+    rows = {}
+    for rec in records:
+        row = rows.setdefault(rec["stage"], {"stage": rec["stage"], "calls": 0, "wall_s": 0.0, "peak_mb": 0.0, "counts": {}})
+        row["calls"] += 1
+        row["wall_s"] += rec["wall_s"]
+        row["peak_mb"] = max(row["peak_mb"], rec["peak_mb"])
+        for key, value in rec.items():
+            if key in ("stage", "seq", "time", "wall_s", "rss_mb", "peak_mb") or key.endswith("_per_s"):
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                row["counts"][key] = row["counts"].get(key, 0) + value
+    for row in rows.values():
+        row["rates"] = {key: value / row["wall_s"] for key, value in row["counts"].items() if row["wall_s"] > 0}
+    return list(rows.values())
+
+
+def summary_lines(records):
+    lines = []
+    for row in summarize(records):
+        counts = ",  ".join(f'{key}: {value:g} ({row["rates"].get(key, 0):.3g}/s)' for key, value in row["counts"].items())
+        lines.append(f'{row["stage"]}:  {row["calls"]} call(s),  {row["wall_s"]:.3f} s,  peak {row["peak_mb"]:.0f} MB' + (f',  {counts}' if counts else ''))
+    return lines
+
+
+recorder = Recorder()
+stage = recorder.stage
+
+
+def timed(name, **counts):
+    # Decorator recording every call of the function as stage name; counts are functions of its result
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with stage(name) as rec:
+                result = fn(*args, **kwargs)
+                for key, count in counts.items():
+                    rec[key] = count(result)
+                return result
+        return run
+    return wrap
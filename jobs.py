@@ -0,0 +1,89 @@
+from PySide6.QtCore import QObject, QThread, Signal, Slot
+from engine import Cancelled
+
+
+class Worker(QObject):
+    progress = Signal(int)
+    done = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+    def __init__(self, fn, args, kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancel_requested = False
+        self.percent = -1
+
+    def report(self, done, total):
+        # Passed to the engine as progress(done, total); raising here is how a job is cancelled
+        if self.cancel_requested:
+            raise Cancelled()
+        percent = int(100 * done / total) if total else 0
+        if percent != self.percent:
+            self.percent = percent
+            self.progress.emit(percent)
+
+    @Slot()
+    def run(self):
+        try:
+            result = self.fn(*self.args, progress=self.report, **self.kwargs)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.done.emit(result)
+
+
+class JobRunner(QObject):
+    # Runs one heavy engine call at a time on a worker thread.
+    # fn must accept a progress=callback(done, total) keyword; on_done gets its result on the UI thread.
+    progress = Signal(int)
+    failed = Signal(str)
+    cancelled = Signal()
+    idle = Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread = None
+        self.worker = None
+        self.on_done = None
+
+    def busy(self):
+        return self.thread is not None
+
+    def start(self, fn, *args, on_done=None, **kwargs):
+        if self.busy():
+            return False
+        self.on_done = on_done
+        self.thread = QThread()
+        self.worker = Worker(fn, args, kwargs)
+        self.worker.moveToThread(self.thread)
+        self.thread.started.connect(self.worker.run)
+        self.worker.progress.connect(self.progress)
+        self.worker.done.connect(self.finish)
+        self.worker.failed.connect(self.failed)
+        self.worker.cancelled.connect(self.cancelled)
+        for signal in (self.worker.done, self.worker.failed, self.worker.cancelled):
+            signal.connect(self.thread.quit)
+        self.thread.finished.connect(self.cleanup)
+        self.thread.start()
+        return True
+
+    def cancel(self):
+        if self.worker is not None:
+            self.worker.cancel_requested = True
+
+    @Slot(object)
+    def finish(self, result):
+        if self.on_done is not None:
+            self.on_done(result)
+
+    @Slot()
+    def cleanup(self):
+        self.thread.wait()
+        self.worker.deleteLater(); self.thread.deleteLater()
+        self.thread = None; self.worker = None; self.on_done = None
+        self.idle.emit()
@@ -2,15 +2,19 @@ from PySide6.QtWidgets import QApplication
 from widget import Widget
 import sys
 import os
+import multiprocessing
 
 try: 
     os.chdir(sys._MEIPASS)
 except:
     os.chdir(os.getcwd())
 
-app = QApplication(sys.argv)
+if __name__ == "__main__":
+    # Worker processes of the parallel sort re-import this module; only the main process opens the window
+    multiprocessing.freeze_support()
+    app = QApplication(sys.argv)
 
-widget = Widget()
-widget.show()
+    widget = Widget()
+    widget.show()
 
-app.exec()
\ No newline at end of file
+    app.exec()
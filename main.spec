@@ -10,7 +10,7 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=['sklearn'],     # r2_score is computed with numpy (engine.r2_score)
     noarchive=False,
     optimize=0,
 )
@@ -1,6 +1,5 @@
 from PySide6.QtWidgets import *
 from PySide6.QtCore import Qt
-import pandas as pd
 import numpy as np
 
 
@@ -82,6 +81,7 @@ class DetailWindow(QWidget):
         
         
     def export_csv(self):
+        import pandas as pd     # imported on first export: it is slow to load
         filename = self.exportLine.text()
         array_df = pd.DataFrame(np.copy(self.meta_array), dtype=int)
         array_df.to_csv('./Export/Array_' + filename + '.csv', header=False, index=False)
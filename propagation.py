@@ -0,0 +1,197 @@
+import math
+import numpy as np
+import cache
+
+fft_backend = False     # scipy.fft once backend() has run (None without scipy); imported on first use
+
+# Transfer functions are reused across Propagate clicks and candidates with the same (wl, pitch, z, size)
+transfer_cache = cache.LibraryCache(max_bytes=1024 * 2**20)
+
+
+def backend():
+    # scipy.fft: multithreaded, single precision kept as is. Imported here rather than at startup
+    global fft_backend
+    if fft_backend is False:
+        try:
+            import scipy.fft as fft_backend
+        except ImportError:
+            fft_backend = None
+    return fft_backend
+
+
+def fast_size(n):
+    # Smallest 2^a 3^b 5^c >= n
+    if backend() is not None:
+        return fft_backend.next_fast_len(n)
+    best = 1
+    while best < n:
+        best *= 2
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            size = p35
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def fft2(a, inverse=False):
+    # In place where the backend allows it; a is not used afterwards
+    if backend() is not None:
+        return (fft_backend.ifft2 if inverse else fft_backend.fft2)(a, workers=-1, overwrite_x=True)
+    return (np.fft.ifft2 if inverse else np.fft.fft2)(a)
+
+
+def transfer_function(wl, pitch, z, n, dtype=np.complex128):
+    # Angular spectrum H = exp(i k z sqrt(1 - (wl fx)^2 - (wl fy)^2)) on an n x n grid, in FFT order so that
+    # no fftshift is needed; evanescent components are set to 0
+    def build():
+        f2 = (wl * np.fft.fftfreq(n, pitch))**2
+        H = np.zeros((n, n), dtype=dtype)
+        kz = 2*math.pi/wl * z
+        for i0 in range(0, n, 256):     # row blocks keep the float64 temporaries small
+            arg = 1 - f2[i0:i0+256, np.newaxis] - f2[np.newaxis, :]
+            prop = arg >= 0
+            H[i0:i0+256][prop] = np.exp(1j * kz * np.sqrt(arg[prop]))
+        return H
+    return transfer_cache.get((wl, pitch, z, n, np.dtype(dtype).str), build)
+
+
+def propagate_field(field, pitch, wl, z, pad=2, dtype=np.complex128, progress=None):
+    # Field (n x n, sampled at pitch) after propagating by z. It is zero-padded to a fast FFT size >= pad * n
+    # and cropped back to n x n; progress(done, total) is called between the steps
+    n = field.shape[0]
+    m = fast_size(pad * n)
+    s = (m - n) // 2
+    if progress is not None:
+        progress(0, 3)
+    U = np.zeros((m, m), dtype=dtype)
+    U[s:s+n, s:s+n] = field
+    H = transfer_function(wl, pitch, z, m, dtype)
+    if progress is not None:
+        progress(1, 3)
+    U = fft2(U)
+    U *= H
+    if progress is not None:
+        progress(2, 3)
+    U = fft2(U, inverse=True)
+    return U[s:s+n, s:s+n]
+
+
+def axial_wavenumber(wl, pitch, n):
+    # kz = 2 pi / wl sqrt(1 - (wl fx)^2 - (wl fy)^2) in FFT order (0 where evanescent) and the propagating mask
+    def build():
+        f2 = (wl * np.fft.fftfreq(n, pitch))**2
+        arg = 1 - f2[:, np.newaxis] - f2[np.newaxis, :]
+        prop = arg >= 0
+        return 2*math.pi/wl * np.sqrt(np.where(prop, arg, 0)), prop
+    return transfer_cache.get(('kz', wl, pitch, n), build)
+
+
+def propagate_stack(field, pitch, wl, zs, out, pad=2, dtype=np.complex128, max_bytes=256 * 2**20, progress=None):
+    # Intensity |E|^2 of field (n x n) at every distance in zs, written to out[k] (e.g. a memmap of shape
+    # [len(zs), n, n]). The padded field is transformed once; each plane costs a transfer function and an
+    # inverse FFT, done in batches of planes that fit in max_bytes.
+    n = field.shape[0]
+    m = fast_size(pad * n)
+    s = (m - n) // 2
+    nz = len(zs)
+    U = np.zeros((m, m), dtype=dtype)
+    U[s:s+n, s:s+n] = field
+    spectrum = fft2(U)
+    kz, prop = axial_wavenumber(wl, pitch, m)
+    spectrum[~prop] = 0      # evanescent components, dropped once for all planes
+    batch = max(1, min(nz, max_bytes // (m * m * 32)))
+    for k0 in range(0, nz, batch):
+        if progress is not None:
+            progress(k0, nz)
+        z = np.asarray(zs[k0:k0+batch], dtype=np.float64)
+        B = np.exp(1j * z[:, np.newaxis, np.newaxis] * kz).astype(dtype, copy=False)
+        B *= spectrum
+        B = fft2(B, inverse=True)
+        E = B[:, s:s+n, s:s+n]
+        out[k0:k0+len(z)] = E.real**2 + E.imag**2
+    if progress is not None:
+        progress(nz, nz)
+    return out
+
+
+def batch_size(n, pad=2, dtype=np.complex128, max_bytes=256 * 2**20):
+    # Fields of n x n that propagate_batch transforms together within max_bytes
+    m = fast_size(pad * n)
+    return max(1, max_bytes // (m * m * np.dtype(dtype).itemsize))
+
+
+def propagate_batch(fields, pitch, wl, z, pad=2, dtype=np.complex128):
+    # Yields (k, E_k) for each field of the list fields (all n x n, same pitch) propagated by z. The fields
+    # are stacked and transformed together (keep the list within batch_size); they share one cached transfer
+    # function.
+    n = fields[0].shape[0]
+    m = fast_size(pad * n)
+    s = (m - n) // 2
+    H = transfer_function(wl, pitch, z, m, dtype)
+    U = np.zeros((len(fields), m, m), dtype=dtype)
+    for k, field in enumerate(fields):
+        U[k, s:s+n, s:s+n] = field
+    U = fft2(U)
+    U *= H
+    U = fft2(U, inverse=True)
+    for k in range(len(fields)):
+        yield k, U[k, s:s+n, s:s+n]
+
+
+def hankel_zeros(N):
+    # First N + 1 zeros of J0 and |J1| at the first N of them
+    def build():
+        from scipy import special
+        j = special.jn_zeros(0, N + 1)
+        return j, np.abs(special.j1(j[:N]))
+    return transfer_cache.get(('qdht', N), build)
+
+
+def hankel_grid(N, R):
+    # Radii r_n (m) and spatial frequencies v_n (1/m) of the order-0 quasi-discrete Hankel transform on N
+    # samples within R (Guizar-Sicairos & Gutierrez-Vega, JOSA A 21, 53 (2004))
+    j, _ = hankel_zeros(N)
+    return j[:N] * R / j[N], j[:N] / (2*math.pi*R)
+
+
+def hankel_apply(x, rows=None, block_bytes=32 * 2**20, progress=None):
+    # T x with T[m, n] = 2 J0(j_m j_n / S) / (|J1(j_m)| |J1(j_n)| S), for the output samples m < rows. T is its own
+    # inverse; it is built in row blocks on the fly, so memory stays O(N) and the cost is O(rows * N).
+    from scipy import special
+    N = x.shape[0]
+    rows = N if rows is None else rows
+    j, J1 = hankel_zeros(N)
+    S = j[N]
+    scaled = x / J1 * (2 / S)
+    out = np.empty(rows, dtype=np.result_type(x, np.float64))
+    step = max(1, block_bytes // (8 * N))
+    for m0 in range(0, rows, step):
+        if progress is not None:
+            progress(m0, rows)
+        m1 = min(m0 + step, rows)
+        out[m0:m1] = special.j0(np.outer(j[m0:m1] / S, j[:N])) @ scaled / J1[m0:m1]
+    if progress is not None:
+        progress(rows, rows)
+    return out
+
+
+def propagate_radial(field, R, wl, z, rows=None, progress=None):
+    # Rotationally symmetric field sampled on hankel_grid(N, R) propagated by z; returns it at the first rows
+    # radii. Forward QDHT, angular spectrum transfer function (evanescent components dropped), inverse QDHT.
+    # The R and V factors of the two transforms cancel out, leaving the 1 / |J1| sample weights.
+    N = field.shape[0]
+    _, v = hankel_grid(N, R)
+    arg = 1 - (wl * v)**2
+    H = np.where(arg >= 0, np.exp(1j * 2*math.pi/wl * z * np.sqrt(np.maximum(arg, 0))), 0)
+    _, J1 = hankel_zeros(N)
+    rows = N if rows is None else rows
+    forward = None if progress is None else lambda done, total: progress(done, 2 * N)
+    G = hankel_apply(field / J1, progress=forward) * H
+    inverse = None if progress is None else lambda done, total: progress(N + done * N // max(total, 1), 2 * N)
+    return hankel_apply(G, rows, progress=inverse) * J1[:rows]
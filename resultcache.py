@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import hashlib
+import zipfile
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# On-disk cache of search / sort results, addressed by a hash of everything they depend on (see
+# engine.search_digest / engine.rank_digest). An entry is one uncompressed .npz: the result keys in order and
+# the arrays; arrays that are the unchanged input of a sort are stored as an index into that input instead.
+# The folder is kept under max_bytes by deleting the least recently used entries. The cache is off until enabled
+# (the command line and the GUI turn it on), so library users, tests and benchmarks do not touch the user's cache.
+VERSION = 1
+
+
+def default_dir():
+    path = os.environ.get("METACRAFT_CACHE")
+    if path:
+        return path
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "MetaCraft", "results")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "metacraft", "results")
+
+
+def digest(kind, params, rst_dict=None):
+    # params: JSON-serialisable description of the request; rst_dict: input arrays, hashed by content
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps([VERSION, kind, params]).encode())
+    for key, ar in (rst_dict or {}).items():
+        ar = np.ascontiguousarray(ar)
+        h.update(json.dumps([key, ar.dtype.str, ar.shape]).encode())
+        h.update(ar.data)
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path=None, max_bytes=1024 * 2**20):
+        self.path = path or default_dir()
+        self.max_bytes = max_bytes
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def file(self, digest):
+        return os.path.join(self.path, digest + ".npz")
+
+    def get(self, digest, run, base=None):
+        # Stored result for digest, else run() (stored for next time). base: the input dict of a sort
+        if not self.enabled:
+            return run()
+        result = self.load(digest, base)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = run()
+        self.store(digest, result, base)
+        return result
+
+    def load(self, digest, base=None):
+        path = self.file(digest)
+        base_values = list((base or {}).values())
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                keys = npz["keys"].tolist(); refs = npz["refs"]
+                values = [base_values[r] if r >= 0 else npz[f"a{k}"] for k, r in enumerate(refs)]
+                ordered = bool(npz["ordered"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, IndexError, zipfile.BadZipFile):
+            self.remove(path)     # unreadable or written by another version
+            return None
+        try:
+            os.utime(path)        # most recently used
+        except OSError:
+            pass
+        return (OrderedDict if ordered else dict)(zip(keys, values))
+
+    def store(self, digest, result, base=None):
+        base_ids = {id(ar): n for n, ar in enumerate((base or {}).values())}
+        refs = np.array([base_ids.get(id(ar), -1) for ar in result.values()], dtype=np.int64)
+        arrays = {f"a{k}": ar for k, (ar, r) in enumerate(zip(result.values(), refs)) if r < 0}
+        path = self.file(digest)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, "wb") as f:
+                np.savez(f, keys=np.array(list(result), dtype=str), refs=refs, ordered=np.array(isinstance(result, OrderedDict)), **arrays)
+            os.replace(tmp, path)
+        except OSError:
+            self.remove(tmp)
+            return
+        self.evict(self.max_bytes)
+
+    def entries(self):
+        # (mtime, size, path) of every entry, oldest first
+        try:
+            files = [e for e in os.scandir(self.path) if e.name.endswith(".npz")]
+        except OSError:
+            return []
+        found = []
+        for e in files:
+            try:
+                stat = e.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime_ns, stat.st_size, e.path))
+        return sorted(found)
+
+    def nbytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_bytes):
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= max_bytes:
+                    break
+                self.remove(path)
+                total -= size
+
+    def resize(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.evict(max_bytes)
+
+    def clear(self):
+        self.evict(0)
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,183 @@
+from PySide6.QtWidgets import QTableView, QAbstractItemView, QHeaderView
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex
+import numpy as np
+from engine import nm, split_key
+
+PAGE_SIZE = 1000
+
+
+def fmt_nm(v):
+    return f'{int(round(v/nm, -1))}'
+
+def fmt_pct(v):
+    return f'{100*v:.1f}'
+
+def fmt_rad(v):
+    return f'{v:.2f}'
+
+def fmt_int(v):
+    return f'{int(v)}'
+
+def fmt_1f(v):
+    return f'{v:.1f}'
+
+def fmt_2f(v):
+    return f'{v:.2f}'
+
+def fmt_4f(v):
+    return f'{v:.4f}'
+
+
+class ResultModel(QAbstractTableModel):
+    # Search / Sort results straight from the result arrays: one table row per meta-atom (search, Dependent sort)
+    # or per (mat, H, P) library (Independent sort). Cells are formatted when the view asks for them,
+    # rows are exposed page by page and header clicks reorder an index array only.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.set_message(None)
+
+    def set_message(self, message):
+        self.beginResetModel()
+        self.message = message
+        self.headers = []; self.formats = []
+        self.table = np.zeros((0, 0)); self.group = np.zeros(0, dtype=int); self.row = np.zeros(0, dtype=int)
+        self.keys = []; self.group_labels = []; self.shape = None
+        self.order = np.zeros(0, dtype=int); self.loaded = 0
+        self.endResetModel()
+
+    def set_result(self, req, rst_dict, ranked=False):
+        keys = list(rst_dict)
+        if len(keys) == 0 or sum(np.shape(rst_dict[k])[0] for k in keys) == 0:
+            self.set_message("No result found")
+            return
+        self.beginResetModel()
+        self.message = None
+        self.keys = keys
+        self.group_labels = [split_key(key)[0] for key in keys]
+        self.shape = None
+        if ranked and req.pol == "Independent" and req.sort_choice == "Focusing":
+            # key: "mat-H-P-meanAR-meanT-Strehl-FWHM-Eff-numel"
+            self.headers = ['Material', 'H (nm)', 'P (nm)', 'mean AR', 'mean T (%)', 'Strehl', 'FWHM (nm)', 'Efficiency (%)']
+            self.formats = [fmt_int, fmt_int, fmt_1f, fmt_1f, fmt_4f, fmt_int, fmt_2f]
+            self.table = np.array([[float(v) for v in split_key(key)[1][:7]] for key in keys])
+            self.group = np.arange(len(keys)); self.row = np.zeros(len(keys), dtype=int)
+        elif ranked and req.pol == "Independent":
+            # key: "mat-H-P-meanAR-meanT-FOM-numel"
+            self.headers = ['Material', 'H (nm)', 'P (nm)', 'mean AR', 'mean T (%)', 'FoM']
+            self.formats = [fmt_int, fmt_int, fmt_1f, fmt_1f, fmt_4f]
+            self.table = np.array([[float(v) for v in split_key(key)[1][:5]] for key in keys])
+            self.group = np.arange(len(keys)); self.row = np.zeros(len(keys), dtype=int)
+        else:
+            sizes = [rst_dict[k].shape[0] for k in keys]
+            self.group = np.repeat(np.arange(len(keys)), sizes)
+            self.row = np.concatenate([np.arange(n) for n in sizes])
+            if req.pol == "Independent" and req.pol_value == 'Co-pol':
+                # H-P-R(X)-T-phase-shape
+                self.headers = ['Material', 'H (nm)', 'P (nm)', 'R / L (nm)', 'T (%)', 'φ (rad)']
+                self.formats = [fmt_nm, fmt_nm, fmt_nm, fmt_pct, fmt_rad]
+                table = np.concatenate([rst_dict[k] for k in keys], axis=0)
+                self.table = table[:, :5]; self.shape = table[:, 5]
+            else:
+                # H-P-L-W-T-phase(-FoM)
+                self.headers = ['Material', 'H (nm)', 'P (nm)', 'X (nm)', 'Y (nm)', 'T (%)', 'φ (rad)']
+                self.formats = [fmt_nm, fmt_nm, fmt_nm, fmt_nm, fmt_pct, fmt_rad]
+                ncol = 6
+                if ranked and all(rst_dict[k].shape[1] > 6 for k in keys):
+                    self.headers.append('FoM'); self.formats.append(fmt_4f); ncol = 7
+                self.table = np.concatenate([rst_dict[k][:, :ncol] for k in keys], axis=0)
+        self.order = np.arange(self.table.shape[0])
+        self.loaded = min(PAGE_SIZE, self.table.shape[0])
+        self.endResetModel()
+
+    # Qt model interface
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 1 if self.message is not None else self.loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return 1 if self.message is not None else len(self.headers)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.message is None and self.loaded < self.table.shape[0]
+
+    def fetchMore(self, parent=QModelIndex()):
+        num = min(PAGE_SIZE, self.table.shape[0] - self.loaded)
+        self.beginInsertRows(QModelIndex(), self.loaded, self.loaded + num - 1)
+        self.loaded += num
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or orientation != Qt.Horizontal:
+            return None
+        if self.message is not None:
+            return "Result"
+        return self.headers[section]
+
+    def flags(self, index):
+        if self.message is not None:
+            return Qt.ItemIsEnabled
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        if self.message is not None:
+            return self.message
+        r = self.order[index.row()]; c = index.column()
+        if c == 0:
+            label = self.group_labels[self.group[r]]
+            if self.shape is not None:
+                label += '-circle' if self.shape[r] == 1 else '-square'
+            return label
+        return self.formats[c - 1](self.table[r, c - 1])
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if self.message is not None or column < 0:
+            return
+        self.layoutAboutToBeChanged.emit()
+        if column == 0:
+            label_rank = np.argsort(np.argsort(self.group_labels, kind='stable'), kind='stable')
+            sort_key = label_rank[self.group].astype(float)
+        else:
+            sort_key = self.table[:, column - 1]
+        if order == Qt.DescendingOrder:
+            sort_key = -sort_key
+        self.order = np.argsort(sort_key, kind='stable')
+        self.layoutChanged.emit()
+
+    # Selection -> results
+    def entry(self, view_row):
+        # (key, row index within rst_dict[key]) of a view row
+        r = self.order[view_row]
+        return self.keys[self.group[r]], int(self.row[r])
+
+
+class ResultView(QTableView):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.result_model = ResultModel(self)
+        self.setModel(self.result_model)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setAlternatingRowColors(True)
+        self.verticalHeader().setVisible(False)
+        header = self.horizontalHeader()
+        header.setSectionResizeMode(QHeaderView.Stretch)
+        header.setSectionsClickable(True)
+        header.setSortIndicatorShown(True)
+        header.sortIndicatorChanged.connect(self.result_model.sort)
+
+    def show_result(self, req, rst_dict, ranked=False):
+        self.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self.result_model.set_result(req, rst_dict, ranked)
+        self.scrollToTop()
+
+    def selected_entries(self):
+        rows = sorted({index.row() for index in self.selectionModel().selectedRows()})
+        if self.result_model.message is not None:
+            return []
+        return [self.result_model.entry(row) for row in rows]
@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import numpy as np
+
+# Packed material store: every Materials/*.npy in one memory-mapped file.
+# Each library's rows are sorted by (H, P) and come with a table of its (H, P) groups,
+# so the height / pitch limits of a search select row ranges without reading the other rows.
+# Rows are returned in their .npy order (kept as a row index block for libraries that were not sorted).
+BIN_NAME = "library.bin"
+INDEX_NAME = "library.json"
+ALIGN = 4096
+
+_stores = {}
+
+
+def _write_block(f, ar):
+    pad = -f.tell() % ALIGN
+    f.write(b'\0' * pad)
+    offset = f.tell()
+    f.write(np.ascontiguousarray(ar).tobytes())
+    return offset
+
+
+def pack(matdir):
+    libraries = {}
+    with open(os.path.join(matdir, BIN_NAME), 'wb') as f:
+        for name in sorted(os.listdir(matdir)):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(matdir, name)
+            rst = np.load(path)
+            order = np.lexsort((rst[:, 1], rst[:, 0]))
+            rst = rst[order]
+            # Group boundaries of identical (H, P)
+            change = np.any(rst[1:, :2] != rst[:-1, :2], axis=1)
+            bounds = np.concatenate(([0], np.flatnonzero(change) + 1, [rst.shape[0]])).astype(np.int64) if rst.shape[0] else np.zeros(1, np.int64)
+            hp = rst[bounds[:-1], :2]
+            stat = os.stat(path)
+            libraries[name] = {"dtype": rst.dtype.str, "rows": rst.shape[0], "cols": rst.shape[1], "groups": hp.shape[0],
+                               "data": _write_block(f, rst), "hp": _write_block(f, hp), "bounds": _write_block(f, bounds),
+                               "order": None if np.all(order[1:] > order[:-1]) else _write_block(f, order.astype(np.int64)),
+                               "mtime": stat.st_mtime_ns, "size": stat.st_size}
+    with open(os.path.join(matdir, INDEX_NAME), 'w') as f:
+        json.dump({"version": 2, "libraries": libraries}, f)
+    return libraries
+
+
+class LibraryStore:
+    def __init__(self, matdir):
+        self.matdir = matdir
+        with open(os.path.join(matdir, INDEX_NAME)) as f:
+            self.index = json.load(f)["libraries"]
+        self.buf = np.memmap(os.path.join(matdir, BIN_NAME), dtype=np.uint8, mode='r')
+
+    def _block(self, offset, dtype, shape):
+        dtype = np.dtype(dtype)
+        return self.buf[offset:offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+
+    def fresh(self, name):
+        # The packed copy is only used while the source .npy is unchanged (and when packed with its row order)
+        entry = self.index.get(name)
+        try:
+            stat = os.stat(os.path.join(self.matdir, name))
+        except FileNotFoundError:
+            return False
+        return entry is not None and "order" in entry and entry["mtime"] == stat.st_mtime_ns and entry["size"] == stat.st_size
+
+    def rows(self, name, max_H=np.inf, max_P=np.inf):
+        # Rows with H <= max_H and P <= max_P (a superset for either float precision; the caller filters exactly)
+        if not self.fresh(name):
+            return None
+        e = self.index[name]
+        hp = self._block(e["hp"], e["dtype"], (e["groups"], 2))
+        bounds = self._block(e["bounds"], np.int64, (e["groups"] + 1,))
+        data = self._block(e["data"], e["dtype"], (e["rows"], e["cols"]))
+        hp64 = hp.astype(np.float64)
+        sel = np.flatnonzero(((hp[:, 0] <= max_H) | (hp64[:, 0] <= max_H)) & ((hp[:, 1] <= max_P) | (hp64[:, 1] <= max_P)))
+        if sel.shape[0] == 0:
+            return data[:0].copy()
+        # Merge consecutive groups into contiguous row ranges
+        starts = bounds[sel]; ends = bounds[sel + 1]
+        run = np.flatnonzero(starts[1:] != ends[:-1]) + 1
+        run_starts = starts[np.concatenate(([0], run))]
+        run_ends = ends[np.concatenate((run - 1, [sel.shape[0] - 1]))]
+        rst = np.concatenate([data[start:end] for start, end in zip(run_starts, run_ends)], axis=0)
+        if e["order"] is None:
+            return rst
+        # Back to the .npy order, so results and their --pick indices do not depend on packing
+        order = self._block(e["order"], np.int64, (e["rows"],))
+        return rst[np.argsort(np.concatenate([order[start:end] for start, end in zip(run_starts, run_ends)]))]
+
+
+def open_store(matdir):
+    index_path = os.path.join(matdir, INDEX_NAME)
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if matdir not in _stores or _stores[matdir][0] != mtime:
+        _stores[matdir] = (mtime, LibraryStore(matdir))
+    return _stores[matdir][1]
+
+
+if __name__ == "__main__":
+    matdir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "Materials")
+    libraries = pack(matdir)
+    print(f"Packed {len(libraries)} libraries ({sum(e['rows'] for e in libraries.values())} rows) into {os.path.join(matdir, BIN_NAME)}")
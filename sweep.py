@@ -0,0 +1,157 @@
+import os
+import csv
+import math
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import replace
+import engine
+import exporter
+
+# Parameter sweep: search + sort for every combination of grids of request fields, on a process pool.
+# Points with the same wavelength are run by the same worker where possible and load each library once, with
+# the loosest height / pitch limits of the points they serve (see engine.cached_library). The best candidates
+# of every point are gathered in one table ranked by score.
+GRID_FIELDS = {"wavelength": str, "na": float, "f": float, "D": float, "min_T": float, "max_H": int, "max_AR": float}
+COLUMNS = ["rank", "point", "point_rank", "wavelength", "na", "f", "D", "min_T", "max_H", "max_AR", "sort",
+           "material", "H", "P", "mean_AR", "mean_T", "score", "strehl", "fwhm", "pick", "key"]
+
+
+def parse_values(text, cast):
+    # "START:STOP:NUM" (NUM values, ends included) or a single value
+    if text.count(":") == 2:
+        start, stop, num = text.split(":")
+        values = [float(start) + (float(stop) - float(start)) * k / max(int(num) - 1, 1) for k in range(int(num))]
+        return [cast(f"{v:g}") if cast is str else cast(round(v, 9)) for v in values]
+    return [cast(text)]
+
+
+def grid_requests(base, grids):
+    # Every combination of grids ({field: [values]}) applied to the base DesignRequest, in row-major order
+    names = list(grids)
+    return [replace(base, **dict(zip(names, values)), workers=1) for values in itertools.product(*(grids[n] for n in names))]
+
+
+def candidate_rows(req, sorted_rst_dict, keep):
+    # The first `keep` candidates of a sorted result, best first. pick is the --pick index of the candidate
+    rows = []
+    if req.pol == "Dependent":
+        # Candidates are meta-atoms: H-P-L-W-T-phase(-FOM)
+        atoms = []
+        pick = 0
+        for key, rst in sorted_rst_dict.items():
+            mat = key.rsplit("-", 1)[0]
+            for i, arr in enumerate(rst):
+                score = round(float(arr[6]), 4) if req.sort_choice == "FoM" else round(100 * float(arr[4]), 1)
+                atoms.append((-score, pick + i, mat, arr))
+            pick += rst.shape[0]
+        for negative_score, i, mat, arr in sorted(atoms, key=lambda a: (a[0], a[1]))[:keep]:
+            rows.append(dict(material=mat, H=int(round(arr[0]/engine.nm, -1)), P=int(round(arr[1]/engine.nm, -1)),
+                             mean_AR=round(float(arr[0] / min(arr[2], arr[3])), 2), mean_T=round(100 * float(arr[4]), 1),
+                             score=-negative_score, pick=i, key=""))
+        return rows
+    for i, key in enumerate(list(sorted_rst_dict)[:keep]):
+        if req.sort_choice == "Focusing":
+            mat, (H, P, AR, T, strehl, fwhm, eff, _) = engine.split_key(key)
+            rows.append(dict(material=mat, H=int(H), P=int(P), mean_AR=float(AR), mean_T=float(T), score=float(eff),
+                             strehl=float(strehl), fwhm=float(fwhm), pick=i, key=key))
+        else:
+            mat, (H, P, AR, T, fom, _) = engine.split_key(key)
+            rows.append(dict(material=mat, H=int(H), P=int(P), mean_AR=float(AR), mean_T=float(T), score=float(fom), pick=i, key=key))
+    return rows
+
+
+def run_point(req, keep, hp_limit=None):
+    rst_dict = engine.search(req, hp_limit=hp_limit)
+    # A Dependent search with no matches still holds an empty "mat-0" array
+    if sum(ar.shape[0] for ar in rst_dict.values()) == 0:
+        return []
+    return candidate_rows(req, engine.rank(req, rst_dict), keep)
+
+
+def set_result_cache(path, max_bytes, enabled):
+    # Worker processes start with their own engine.result_cache: give them the settings of the parent's
+    engine.result_cache.path = path; engine.result_cache.max_bytes = max_bytes; engine.result_cache.enabled = enabled
+
+
+def run_chunk(points, keep):
+    # points: [(n, req)] sharing a wavelength; libraries are loaded once with the loosest limits among them
+    hp_limit = (max(engine.load_limits(req)[0] for _, req in points), max(engine.load_limits(req)[1] for _, req in points))
+    return [(n, run_point(req, keep, hp_limit)) for n, req in points]
+
+
+def chunks(requests, workers):
+    # Points grouped by wavelength; a group is split only to keep every worker busy
+    groups = {}
+    for n, req in enumerate(requests):
+        groups.setdefault(req.wavelength, []).append((n, req))
+    out = []
+    for group in groups.values():
+        pieces = max(1, min(len(group), round(workers * len(group) / len(requests))))
+        size = math.ceil(len(group) / pieces)
+        out += [group[i:i+size] for i in range(0, len(group), size)]
+    return out
+
+
+def run_sweep(requests, workers=1, keep=10, progress=None):
+    # Table rows of every point, ranked by score over the whole sweep (rank), and within their point (point_rank)
+    workers = workers or os.cpu_count() or 1
+    results = {}
+    work = chunks(requests, workers)
+    engine.report(progress, 0, len(requests))
+    if workers == 1 or len(work) == 1:
+        for chunk in work:
+            results.update(run_chunk(chunk, keep))
+            engine.report(progress, len(results), len(requests))
+    else:
+        cache = engine.result_cache
+        with ProcessPoolExecutor(min(workers, len(work)), mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=set_result_cache, initargs=(cache.path, cache.max_bytes, cache.enabled)) as pool:
+            pending = {pool.submit(run_chunk, chunk, keep) for chunk in work}
+            try:
+                while pending:
+                    finished, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        results.update(future.result())
+                    engine.report(progress, len(results), len(requests))
+            finally:
+                for future in pending:
+                    future.cancel()
+    rows = []
+    for n, req in enumerate(requests):
+        for point_rank, row in enumerate(results[n]):
+            rows.append(dict(point=n, point_rank=point_rank, wavelength=req.wavelength, na=req.na, f=req.f, D=req.D,
+                             min_T=req.min_T, max_H=req.max_H, max_AR=req.max_AR, sort=req.sort_choice, **row))
+    rows.sort(key=lambda row: (-row["score"], row["point"], row["point_rank"]))
+    for rank, row in enumerate(rows):
+        row["rank"] = rank
+    return rows
+
+
+def write_table(rows, path):
+    # .parquet through pandas (with pyarrow or fastparquet), anything else as CSV. Returns the path written:
+    # a .parquet table falls back to .csv when no parquet engine is installed
+    if path.endswith(".parquet"):
+        import pandas as pd
+        try:
+            pd.DataFrame(rows, columns=COLUMNS).to_parquet(path, index=False)
+            return path
+        except ImportError:
+            path = path[:-len(".parquet")] + ".csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+
+def export_top(requests, rows, k, name, formats):
+    # Layout files of the k best rows of the table, named <name>_top<rank>
+    paths = []
+    for row in rows[:k]:
+        req = requests[row["point"]]
+        rst_dict = engine.rank(req, engine.search(req))
+        rst_ar, key, P = engine.pick_candidate(req, rst_dict, row["pick"])
+        layout = engine.make_layout(req, rst_ar, key, P)
+        paths += [exporter.export(req, layout, f'{name}_top{row["rank"]}', fmt) for fmt in formats]
+    return paths
@@ -0,0 +1,14 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import engine
+
+
+@pytest.fixture(autouse=True)
+def result_cache(tmp_path, monkeypatch):
+    # Tests that turn the result cache on use a folder of their own, never the user's cache
+    monkeypatch.setattr(engine.result_cache, "path", str(tmp_path / "results"))
+    monkeypatch.setenv("METACRAFT_CACHE", str(tmp_path / "results"))
+    return engine.result_cache
@@ -0,0 +1,38 @@
+import math
+from dataclasses import replace
+import numpy as np
+import engine
+import propagation
+
+
+def library(n=200, seed=0):
+    # Co-pol rows H-P-L-T-phase-shape with random transmissions and phases
+    rng = np.random.default_rng(seed)
+    rst_ar = np.zeros((n, 6))
+    rst_ar[:, 0] = 600 * engine.nm; rst_ar[:, 1] = 300 * engine.nm
+    rst_ar[:, 3] = rng.uniform(0.05, 1, n)
+    rst_ar[:, 4] = rng.uniform(-math.pi, math.pi, n)
+    return rst_ar
+
+
+def test_radial_uses_complex_assignment(monkeypatch):
+    req = engine.DesignRequest(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol",
+                               na=0.3, D=20, assignment="Complex", amplitude_weight=0.5)
+    rst_ar = library()
+    P = 300 * engine.nm
+    fields = []
+    def capture(field, *args, **kwargs):
+        fields.append(field)
+        return np.ones(kwargs.get("rows") or field.shape[0], dtype=complex)
+    monkeypatch.setattr(propagation, "propagate_radial", capture)
+    engine.propagate_radial(req, rst_ar, P)
+
+    # The radial profile holds the phases set_metalens assigns to the same targets,
+    R = req.D * engine.um / 2
+    r, _ = propagation.hankel_grid(math.ceil(2 * R / P), R)
+    phase_ideal = engine.gen_phase_map(req, P, 2 * R, radii=r)
+    # with unit amplitude, like the 2D lens_field
+    expected = engine.set_metalens(req, rst_ar, phase_ideal)
+    assert np.allclose(fields[0], np.exp(1j * expected))
+    # which differ from a phase-only assignment for this library
+    assert not np.array_equal(expected, engine.set_metalens(replace(req, assignment="Phase"), rst_ar, phase_ideal))
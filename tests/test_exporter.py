@@ -0,0 +1,32 @@
+import os
+import numpy as np
+import engine
+import exporter
+import instrument
+
+
+def layout(tmp_path):
+    # Small Co-pol lens from a synthetic library
+    req = engine.DesignRequest(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol", na=0.3, D=3,
+                               exportdir=str(tmp_path) + os.sep)
+    n = 16
+    rst_ar = np.column_stack([np.full(n, 600e-9), np.full(n, 300e-9), np.linspace(60e-9, 120e-9, n), np.linspace(0.5, 1, n),
+                              np.linspace(-np.pi, np.pi, n, endpoint=False), np.ones(n)])
+    return req, engine.make_layout(req, rst_ar, "TiO2-600-300-16", 300e-9)
+
+
+def test_export_bytes_count_written_files_only(tmp_path):
+    req, lay = layout(tmp_path)
+    (tmp_path / "lens_unrelated.txt").write_text("x" * 1000)     # shares the VirtualLab base name
+    for fmt, files in [("vl", ["lens_phase.txt", "lens_abs^2.txt"]), ("lsfc", ["lens.lsf", "lens_pillars.txt"]),
+                       ("gds", ["lens.gds"])]:
+        mark = instrument.recorder.mark()
+        exporter.export(req, lay, "lens", fmt)
+        rec = instrument.recorder.since(mark)[-1]
+        assert rec["bytes"] == sum(os.path.getsize(tmp_path / f) for f in files), fmt
+
+
+def test_compact_script_reads_pillars_from_its_folder(tmp_path):
+    req, lay = layout(tmp_path)
+    script = open(exporter.export(req, lay, "lens", "lsfc")).read()
+    assert script.index("cd(filedirectory(currentscriptname));") < script.index('readdata("lens_pillars.txt")') < script.index("cd(workdir);")
@@ -0,0 +1,84 @@
+import os
+import struct
+from dataclasses import replace
+import numpy as np
+import engine
+import exporter
+import geometry
+
+
+def read_gds(path):
+    # {cell: ([polygons], [(cell, origin, columns, rows, pitch)])} from a GDSII stream
+    data = open(path, 'rb').read()
+    cells = {}; pos = 0; element = None
+    while pos < len(data):
+        size, rtype = struct.unpack('>HH', data[pos:pos+4]); body = data[pos+4:pos+size]; pos += size
+        if rtype == 0x0606:
+            name = body.rstrip(b'\0').decode(); cells[name] = ([], [])
+        elif rtype in (0x0800, 0x0A00, 0x0B00):
+            element = {"type": rtype, "colrow": (1, 1)}
+        elif rtype == 0x1206:
+            element["sname"] = body.rstrip(b'\0').decode()
+        elif rtype == 0x1302:
+            element["colrow"] = struct.unpack('>2h', body)
+        elif rtype == 0x1003:
+            element["xy"] = np.frombuffer(body, dtype='>i4').astype(np.int64).reshape(-1, 2)
+        elif rtype == 0x1100:
+            if element["type"] == 0x0800:
+                cells[name][0].append(element["xy"])
+            else:
+                xy = element["xy"]; cols, rows = element["colrow"]
+                pitch = ((xy[1] - xy[0]) // cols) if element["type"] == 0x0B00 else np.zeros(2, np.int64)
+                step_y = ((xy[2] - xy[0]) // rows) if element["type"] == 0x0B00 else np.zeros(2, np.int64)
+                cells[name][1].append((element["sname"], xy[0], cols, rows, pitch, step_y))
+    return cells
+
+
+def flatten(cells, top):
+    # {origin (x, y): polygon} of every atom placed in the top cell
+    placed = {}
+    for sname, origin, cols, rows, step_x, step_y in cells[top][1]:
+        (polygon,) = cells[sname][0]
+        for c in range(cols):
+            for r in range(rows):
+                at = origin + c * step_x + r * step_y
+                assert tuple(at) not in placed
+                placed[tuple(at)] = polygon + at
+    return placed
+
+
+def distinct_vertices(xy):
+    return xy[np.append(True, np.any(xy[1:] != xy[:-1], axis=1))]
+
+
+def lenses():
+    rng = np.random.default_rng(0)
+    n = 40
+    co = np.column_stack([np.full(n, 600e-9), np.full(n, 300e-9), rng.uniform(60e-9, 200e-9, n), rng.uniform(0.3, 1, n),
+                          rng.uniform(-np.pi, np.pi, n), rng.choice([1.0, 2.0], n)]).astype(np.float32)
+    cross = np.column_stack([np.full(n, 600e-9), np.full(n, 300e-9), rng.uniform(60e-9, 200e-9, n), rng.uniform(60e-9, 200e-9, n),
+                             rng.uniform(0.3, 1, n), rng.uniform(-np.pi, np.pi, n)])
+    base = engine.DesignRequest(domain="Visible", wavelength="532", na=0.4, D=12)
+    yield replace(base, pol="Independent", pol_value="Co-pol"), co, "TiO2-600-300-40"
+    yield replace(base, pol="Independent", pol_value="Cross-pol"), cross, "TiO2-600-300-40"
+    yield replace(base, pol="Dependent", pol_value="RCP", rotation_level="8"), cross[0], "TiO2-1"
+
+
+def test_binary_gds_places_every_atom_like_the_text_gds(tmp_path, monkeypatch):
+    for req, rst_ar, key in lenses():
+        for reverse, max_colrow in [(False, exporter.MAX_COLROW), (True, exporter.MAX_COLROW), (False, 3)]:
+            monkeypatch.setattr(exporter, "MAX_COLROW", max_colrow)     # 3: long runs split into several AREFs
+            req = replace(req, reverse_gds=reverse, exportdir=str(tmp_path) + os.sep)
+            layout = engine.make_layout(req, rst_ar, key, 300e-9)
+            cells = read_gds(exporter.export(req, layout, "lens", "gds"))
+            placed = flatten(cells, "lens")
+            grid = np.floor(1e9 * layout.P * np.linspace(-(layout.num-1)/2, (layout.num-1)/2, layout.num) + 0.5).astype(np.int64)
+            expected = {}
+            for pixels, vertices in geometry.lens_polygons(req, layout):
+                i, j = np.divmod(pixels, layout.num)
+                expected.update({(grid[a], grid[b]): xy for a, b, xy in zip(i, j, vertices)})
+            assert placed.keys() == expected.keys()
+            for at, xy in expected.items():
+                # Atoms are drawn once at the origin and placed, so a vertex can differ from the text one by rounding
+                got = placed[at]; xy = distinct_vertices(xy)
+                assert got.shape == xy.shape and np.abs(got - xy).max() <= 1, (req.pol_value, reverse, max_colrow, at)
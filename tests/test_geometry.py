@@ -0,0 +1,71 @@
+import math
+from dataclasses import replace
+import numpy as np
+import engine
+import geometry
+
+
+def pixel_polygon(req, layout, i, j):
+    # Vertices of one pixel's atom, computed one pixel at a time as the text GDS export did before geometry.py
+    rst_ar = layout.rst_ar; P = layout.P; num = layout.num
+    xlin = 1e9 * P * np.linspace(-(num-1)/2, (num-1)/2, num)
+    x = xlin[i]; y = xlin[j]
+    frame = [(x + P/2*1e9, y + P/2*1e9), (x + P/2*1e9, y - P/2*1e9), (x - P/2*1e9, y - P/2*1e9), (x - P/2*1e9, y + P/2*1e9)]
+    if req.pol == "Dependent" or req.pol_value == 'Cross-pol':
+        row = rst_ar if req.pol == "Dependent" else rst_ar[layout.idx[i, j]]
+        l = row[2] * 1e9; w = row[3] * 1e9
+        xh = l/2; yh = w/2
+        corners = [(-xh, yh), (-xh, -yh), (xh, -yh), (xh, yh)]
+        if req.pol == "Dependent":
+            alpha = -layout.phase_meta[i, j]/2 if req.pol_value == 'RCP' else layout.phase_meta[i, j]/2
+            pts = [(x1*math.cos(alpha) - y1*math.sin(alpha) + x, x1*math.sin(alpha) + y1*math.cos(alpha) + y) for x1, y1 in corners]
+            pts.append(pts[0])
+            if req.reverse_gds:
+                top = (pts[0][0], y + P/2*1e9)
+                pts = [top] + pts + [top] + frame + [top]
+        else:
+            pts = [(x + x1, y + y1) for x1, y1 in corners]
+            if req.reverse_gds:
+                pts += [(x, y + yh), (x, y + P/2*1e9)] + frame + [(x, y + P/2*1e9), (x, y + yh)]
+            pts.append((x + corners[0][0], y + corners[0][1]))
+        return [(round(a), round(b)) for a, b in pts]
+    size = rst_ar[layout.idx[i, j], 2] * 1e9
+    if rst_ar[layout.idx[i, j], 5] == 1:
+        theta = 2*math.pi/16
+        l = size*math.tan(theta/2)
+        pts = [(round(x), round(y+size/2)), (round(x-l/2), round(y+size/2))]
+        x_temp = round(x-l/2); y_temp = round(y+size/2)
+        for k in range(1, 14+1):
+            pts.append((round(x_temp-l*math.cos(theta*k)), round(y_temp-l*math.sin(theta*k))))
+            x_temp = x_temp-l*math.cos(theta*k); y_temp = y_temp-l*math.sin(theta*k)
+        pts += [(round(x+l/2), round(y+size/2)), (round(x), round(y+size/2))]
+    else:
+        pts = [(round(a), round(b)) for a, b in [(x, y + size/2), (x - size/2, y + size/2), (x - size/2, y - size/2),
+                                                  (x + size/2, y - size/2), (x + size/2, y + size/2), (x, y + size/2)]]
+    if req.reverse_gds:
+        pts += [(round(a), round(b)) for a, b in [(x, y + P/2*1e9)] + frame + [(x, y + P/2*1e9)]]
+    return pts + [(round(x), round(y + size/2))]
+
+
+def test_batched_polygons_match_per_pixel_vertices():
+    rng = np.random.default_rng(0)
+    n = 40
+    co = np.column_stack([np.full(n, 600e-9), np.full(n, 300e-9), rng.uniform(60e-9, 200e-9, n), rng.uniform(0.3, 1, n),
+                          rng.uniform(-np.pi, np.pi, n), rng.choice([1.0, 2.0], n)]).astype(np.float32)
+    cross = np.column_stack([np.full(n, 600e-9), np.full(n, 300e-9), rng.uniform(60e-9, 200e-9, n), rng.uniform(60e-9, 200e-9, n),
+                             rng.uniform(0.3, 1, n), rng.uniform(-np.pi, np.pi, n)]).astype(np.float32)
+    base = engine.DesignRequest(domain="Visible", wavelength="532", na=0.4, D=9)
+    for req, rst_ar in [(replace(base, pol="Independent", pol_value="Co-pol"), co),
+                        (replace(base, pol="Independent", pol_value="Cross-pol"), cross),
+                        (replace(base, pol="Dependent", pol_value="RCP", rotation_level="8"), cross[0]),
+                        (replace(base, pol="Dependent", pol_value="LCP", rotation_level="16"), cross[1])]:
+        for reverse in (False, True):
+            req = replace(req, reverse_gds=reverse)
+            layout = engine.make_layout(req, rst_ar, "TiO2-600-300-40", 310e-9)
+            found = 0
+            for rows in (None, slice(3, 9)):
+                for pixels, vertices in geometry.lens_polygons(req, layout, rows):
+                    for pix, xy in zip(pixels, vertices):
+                        assert [tuple(v) for v in xy.tolist()] == pixel_polygon(req, layout, *divmod(int(pix), layout.num))
+                    found += len(pixels)
+            assert found == np.count_nonzero(~np.isnan(layout.phase_meta)) + np.count_nonzero(~np.isnan(layout.phase_meta[3:9]))
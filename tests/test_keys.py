@@ -0,0 +1,28 @@
+import os
+import engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_split_key_dashed_material():
+    assert engine.split_key("userMade-Mat-340-300-25") == ("userMade-Mat", ["340", "300", "25"])
+    assert engine.split_key("userMade-Mat-340-300-3.9-44.7-0.7844-25") == ("userMade-Mat", ["340", "300", "3.9", "44.7", "0.7844", "25"])
+    assert engine.split_key("aSi (Vis)-600-250-2.4-80.1--0.1250-12") == ("aSi (Vis)", ["600", "250", "2.4", "80.1", "-0.1250", "12"])
+    assert engine.split_key("userMade-Mat-340-300-3.9-44.7-0.8123-410-55.20-25")[1] == ["340", "300", "3.9", "44.7", "0.8123", "410", "55.20", "25"]
+    assert engine.split_key("ZrO2 (PER)-0") == ("ZrO2 (PER)", ["0"])
+    assert abs(engine.key_pitch("userMade-Mat-340-300-3.9-44.7-0.7844-25") - 300e-9) < 1e-15
+
+
+def test_sorted_lines_dashed_material():
+    req = engine.DesignRequest(pol="Independent", pol_value="Co-pol")
+    lines = engine.rank_lines(req, {"userMade-Mat-340-300-3.9-44.7-0.7844-25": None})
+    assert lines == ["userMade-Mat,  H: 340 nm,  P: 300 nm,  mean AR: 3.9,  mean T: 44.7 %,  FOM: 0.7844"]
+
+
+def test_sort_orders_negative_scores():
+    # Transmittance sorts of this library give negative FoMs ("...--1.3286-38"), ranked by their signed value
+    req = engine.DesignRequest(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol", materials=["TiO2"],
+                               na=0.1, D=10, sort_choice="Transmittance", weight=engine.default_weights("Independent", "Transmittance"),
+                               matdir=os.path.join(ROOT, "Materials", ""))
+    scores = [float(engine.split_key(key)[1][-2]) for key in engine.rank(req, engine.search(req))]
+    assert min(scores) < 0 and scores == sorted(scores, reverse=True)
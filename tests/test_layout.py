@@ -0,0 +1,64 @@
+import math
+import numpy as np
+import engine
+
+
+def nearest_by_matrix(phase_ideal, phase_lib):
+    # argmin over the [pixels, M] wrapped difference matrix, as set_metalens computed it before nearest_phase
+    phase_diff = phase_ideal[:, np.newaxis] - phase_lib[np.newaxis, :]
+    phase_diff[phase_diff > math.pi] -= 2 * math.pi
+    phase_diff[phase_diff < - math.pi] += 2 * math.pi
+    return np.argmin(np.abs(phase_diff), axis=1)
+
+
+def test_nearest_phase_matches_matrix_argmin():
+    rng = np.random.default_rng(0)
+    for M, dtype in [(1, np.float64), (7, np.float64), (200, np.float64), (200, np.float32)]:
+        phase_lib = rng.uniform(-np.pi, np.pi, M).astype(dtype)
+        phase_lib[M // 2:] = np.round(phase_lib[M // 2:], 1)           # duplicates and ties
+        targets = np.concatenate([rng.uniform(-np.pi, np.pi, 5000), [-np.pi, np.pi, 0.0], phase_lib.astype(np.float64),
+                                  (phase_lib[:-1] + phase_lib[1:]) / 2 if M > 1 else []])
+        for chunk in (2**20, 97):
+            got = engine.nearest_phase(targets, phase_lib, chunk=chunk)
+            expected = nearest_by_matrix(targets, phase_lib)
+            assert np.array_equal(got, expected), (M, dtype, chunk)
+
+
+def phase_map_full(req, p, d, num):
+    # 2D phase map on the whole meshgrid, as before the octant evaluation
+    wl = req.wl; f = req.f * engine.um
+    r = p * np.linspace(-(num-1)/2, (num-1)/2, num)
+    xv, yv = np.meshgrid(r, r)
+    required_phase = -2*math.pi / wl * (np.sqrt(f**2 + xv**2 + yv**2) - f)
+    required_phase[xv**2 + yv**2 > (d/2)**2] = np.nan
+    required_phase = required_phase % (2*math.pi)
+    required_phase[required_phase > math.pi] -= 2 * math.pi
+    return required_phase
+
+
+def test_octant_phase_map_and_assignment_match_full_grid():
+    rng = np.random.default_rng(0)
+    rst_ar = np.column_stack([np.full(50, 600e-9), np.full(50, 300e-9), np.full(50, 80e-9), rng.uniform(0.3, 1, 50),
+                              rng.uniform(-np.pi, np.pi, 50), np.ones(50)])
+    for wavelength, f, num in [("532", 250, 33), ("532", 40, 34), ("635", 7.3, 129), ("450", 1000, 200)]:
+        req = engine.DesignRequest(domain="Visible", wavelength=wavelength, pol="Independent", pol_value="Co-pol", f=f)
+        P = 300e-9; D = num * P
+        phase_ideal = engine.gen_phase_map(req, P, D, num=num)
+        assert np.array_equal(phase_ideal, phase_map_full(req, P, D, num), equal_nan=True)
+        phase_real, idx = engine.set_metalens(req, rst_ar, phase_ideal, get_idx=True)
+        inside = ~np.isnan(phase_ideal)
+        expected = nearest_by_matrix(phase_ideal[inside], rst_ar[:, 4])
+        assert np.array_equal(idx[inside], expected + 1) and np.all(idx[~inside] == 0)
+        assert np.array_equal(phase_real[inside], rst_ar[expected, 4]) and np.all(np.isnan(phase_real[~inside]))
+
+
+def test_octant_apply_and_unfold():
+    rng = np.random.default_rng(2)
+    quadrant = rng.random((150, 150)); quadrant = (quadrant + quadrant.T) / 2
+    flip = rng.random((150, 150)) < 0.05
+    quadrant[flip] += np.spacing(quadrant[flip])      # inputs that differ from their transpose in the last bit
+    assert np.array_equal(engine.octant_apply(np.sin, quadrant), np.sin(quadrant))
+    for n in (1, 2, 7, 8, 151):
+        r = np.abs(np.linspace(-(n-1)/2, (n-1)/2, n))
+        full = np.hypot(r[:, np.newaxis], 2 * r[np.newaxis, :])     # mirror-symmetric, not transpose-symmetric
+        assert np.array_equal(engine.unfold(full[:(n+1)//2, :(n+1)//2], n), full)
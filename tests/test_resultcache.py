@@ -0,0 +1,19 @@
+import os
+import numpy as np
+import engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_search_and_sort_come_back_from_the_cache(result_cache, monkeypatch):
+    assert not result_cache.enabled     # off unless the command line or the GUI turns it on
+    monkeypatch.setattr(result_cache, "enabled", True)
+    req = engine.DesignRequest(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol", materials=["TiO2"],
+                               na=0.2, D=10, sort_choice="FoM", weight=[1/3, 1/6, 1/6, 1/3], matdir=os.path.join(ROOT, "Materials", ""))
+    first = engine.rank(req, engine.search(req))
+    hits = result_cache.hits
+    engine.candidate_sets.clear()
+    second = engine.rank(req, engine.search(req))
+    assert result_cache.hits == hits + 2
+    assert list(first) == list(second) and all(np.array_equal(first[k], second[k]) for k in first)
+    assert os.listdir(result_cache.path)
@@ -0,0 +1,72 @@
+import os
+import random
+import numpy as np
+import engine
+
+MATDIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Materials", "")
+
+
+def covers_2pi(phase):
+    # Per-group check group_coverage replaced
+    phase = np.sort(phase)
+    phase_diff = np.abs(phase - np.roll(phase, -1))
+    phase_diff[phase_diff > np.pi] -= 2 * np.pi
+    max_phase_diff = np.max(np.abs(phase_diff))
+    num_section = np.unique(phase // (np.pi/4)).shape[0]
+    return (max_phase_diff < np.pi/4) and (num_section == 8)
+
+
+def test_group_coverage_matches_per_group_check():
+    rng = np.random.default_rng(0)
+    # (H, P) groups with dense (covered), sparse, one-sided or evenly spaced phases, rows shuffled together
+    hp, phase = [], []
+    for g, (H, P) in enumerate((H, P) for H in (300e-9, 400e-9, 500e-9, 600e-9) for P in (200e-9, 250e-9, 300e-9)):
+        kind = g % 4
+        if kind == 0:
+            p = rng.uniform(-np.pi, np.pi, 200)
+        elif kind == 1:
+            p = rng.uniform(-np.pi, np.pi, 12)
+        elif kind == 2:
+            p = rng.uniform(-np.pi, np.pi / 2, 200)
+        else:
+            p = np.linspace(-np.pi, np.pi, 8 + g, endpoint=False)
+        hp += [(H, P)] * len(p); phase.append(p)
+    hp = np.array(hp); phase = np.concatenate(phase)
+    shuffle = rng.permutation(len(phase))
+    hp, phase = hp[shuffle], phase[shuffle]
+    hp_unique, covered, members = engine.group_coverage(hp, phase)
+    assert 0 < covered.sum() < len(covered)
+    for g, key in enumerate(hp_unique):
+        rows = np.flatnonzero(np.all(hp == key, axis=1))
+        assert np.array_equal(members[g], rows)
+        assert covered[g] == covers_2pi(phase[rows])
+
+
+def test_refilter_matches_full_search(monkeypatch):
+    # Searches whose limits only tighten re-filter the last result in memory; each must equal a search from the library
+    calls = []
+    refilter = engine.refilter
+    monkeypatch.setattr(engine, "refilter", lambda *args: calls.append(1) or refilter(*args))
+    random.seed(0)
+    cases = [dict(domain="Visible", wavelength="532", pol="Independent", pol_value="Co-pol", materials=["aSi (Vis)", "TiO2", "TiO2 (PER)"]),
+             dict(domain="Ultra Violet", wavelength="248", pol="Independent", pol_value="Cross-pol", materials=["ZrO2 (PER)"]),
+             dict(domain="Ultra Violet", wavelength="248", pol="Dependent", pol_value="RCP", materials=["ZrO2 (PER)"])]
+    for case in cases:
+        engine.candidate_sets.clear()
+        limits = dict(na=0.1, min_T=0, max_H=1000, max_AR=50)
+        for step in range(8):
+            if step % 4 == 3:
+                limits = dict(na=random.uniform(0.1, 0.4), min_T=random.uniform(0, 60), max_H=random.randint(300, 1000), max_AR=random.uniform(5, 50))
+            else:
+                name = random.choice(list(limits))
+                limits[name] = {"na": limits["na"] * random.uniform(1, 1.3), "min_T": limits["min_T"] + random.uniform(0, 15),
+                                "max_H": int(limits["max_H"] - random.uniform(0, 80)), "max_AR": limits["max_AR"] * random.uniform(0.8, 1)}[name]
+            req = engine.DesignRequest(**case, **limits, matdir=MATDIR)
+            incremental = engine.search(req)
+            saved = engine.candidate_sets.copy(); engine.candidate_sets.clear()
+            full = engine.search(req)
+            engine.candidate_sets.clear(); engine.candidate_sets.update(saved)
+            assert list(incremental) == list(full), (case["pol_value"], limits)
+            for key in full:
+                assert incremental[key].dtype == full[key].dtype and np.array_equal(incremental[key], full[key]), (key, limits)
+    assert len(calls) >= 12
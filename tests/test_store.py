@@ -0,0 +1,13 @@
+import numpy as np
+import store
+
+
+def test_rows_keep_library_order(tmp_path):
+    # An unsorted library comes back from the packed store in its .npy order
+    rng = np.random.default_rng(0)
+    rst = np.column_stack([rng.choice([300e-9, 500e-9, 700e-9], 500), rng.choice([200e-9, 250e-9], 500), rng.random((500, 4))])
+    np.save(tmp_path / "lib.npy", rst)
+    store.pack(str(tmp_path))
+    lib = store.open_store(str(tmp_path))
+    assert np.array_equal(lib.rows("lib.npy"), rst)
+    assert np.array_equal(lib.rows("lib.npy", 500e-9, 220e-9), rst[(rst[:, 0] <= 500e-9) & (rst[:, 1] <= 220e-9)])
@@ -0,0 +1,15 @@
+import os
+import engine
+import sweep
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_dependent_point_without_matches():
+    # min_T = 100 % leaves no meta-atom: the point gives no rows instead of failing the sweep
+    base = engine.DesignRequest(domain="Ultra Violet", wavelength="248", pol="Dependent", pol_value="RCP",
+                                materials=["ZrO2 (PER)"], na=0.1, min_T=0, max_H=1000, max_AR=50,
+                                sort_choice="FoM", weight=[1, 1, 1], matdir=os.path.join(ROOT, "Materials", ""))
+    requests = sweep.grid_requests(base, {"min_T": [0.0, 100.0]})
+    rows = sweep.run_sweep(requests, keep=3)
+    assert [row["point"] for row in rows] == [0, 0, 0]